@@ -13,28 +13,59 @@ app.use('/libs', express.static(__dirname + "/libs"));
 app.engine('html', require('ejs').renderFile);
 
 app.get('/', (req, res, next) => {
+    // the page streams the default simulation from /stream once it has loaded
+    res.render('index.html', {data: JSON.stringify([])});
+});
+
+app.get('/stream', (req, res, next) => {
+  // Stream a simulation as server-sent events: a 'frame' event for each time step, as soon as python has done it,
+  // then 'done' (or 'failed'). Run params are passed as json in the query string, e.g. /stream?params={"agent_number":2}
+  // and optionally a seed (an integer), e.g. /stream?seed=3 (without one, the same params always give the same simulation)
+  let params, seed;
+  try {
+    params = JSON.parse(req.query.params || '{}');
+    seed = req.query.seed === undefined ? undefined : parseInt(req.query.seed);
+  } catch(err) {
+    res.status(400).end("params should be json");
+    return;
+  }
+  if(Number.isNaN(seed)){
+    res.status(400).end("seed should be an integer");
+    return;
+  }
+  res.writeHead(200, {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'Connection': 'keep-alive'});
 
-    runsim.run_py().then((data) => {
-        console.log('Node: python script success!');
-        res.render('index.html', {data: JSON.stringify(data)});
-    })
-    .catch((err)=>{
-      res.end(err);
-    });
+  // stop the simulation if the browser goes away
+  const controller = new AbortController();
+  res.on('close', () => controller.abort());
 
+  runsim.stream_py(params, seed, (frame) => {
+    // if the browser isn't keeping up, pause python until what's been sent so far has gone
+    if(!res.write('event: frame\ndata: ' + frame + '\n\n')){
+      return new Promise((resolve) => res.once('drain', resolve));
+    }
+  }, controller.signal).then(() => {
+    res.end('event: done\ndata: \n\n');
+  })
+  .catch((err)=>{
+    res.end('event: failed\ndata: ' + JSON.stringify(err.message) + '\n\n');
+  });
 });
 
 app.post('/runsim', (req, res, next) => {
-  var params = req.body;
-  console.log("Node: python starting...");
-  runsim.run_py(params).then((data) => {
+  // (the body can include a seed as well as params)
+  var { seed, ...params } = req.body;
+  runsim.run_py(params, seed).then((data) => {
       console.log('Node: python script success!');
       res.send(JSON.stringify(data)).end();
   })
   .catch((err)=>{
-    res.end(err);
+    res.status(500).end(err.message);
   });
 
 })
 
+// start the python workers now, so the first simulation doesn't have to wait for them
+runsim.pool.warm();
+
 app.listen(PORT, () => console.log('Application listening on port '+PORT+'!'));
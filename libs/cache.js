@@ -0,0 +1,95 @@
+// A cache of finished browser simulations on disk, so that a simulation with the same params and seed can be replayed without python
+// (see python/landscape_cache.py for the same idea for landscapes)
+// Each simulation's frames are saved gzipped in <directory>/<key>.gz, where the key is a hash of the params and seed.
+// Using a simulation touches its file, so that when the cache gets too big the least recently used ones can be removed
+const fs = require('fs');
+const path = require('path');
+const crypto = require('crypto');
+const zlib = require('zlib');
+const { promisify } = require('util');
+const gzip = promisify(zlib.gzip);
+const gunzip = promisify(zlib.gunzip);
+
+// increment whenever the frame format changes, so that old results aren't used
+// (changes to the python code, including the default params in GlobalParams, are picked up by the fingerprint: see sourceFingerprint)
+const CACHE_VERSION = 1;
+
+function canonical(value){
+  // json with keys in a fixed order, so that the same params always give the same key
+  if(Array.isArray(value)){
+    return '[' + value.map(canonical).join(',') + ']';
+  } else if(value !== null && typeof value === 'object'){
+    return '{' + Object.keys(value).sort().map((k) => JSON.stringify(k) + ':' + canonical(value[k])).join(',') + '}';
+  }
+  return JSON.stringify(value);
+}
+
+exports.sourceFingerprint = function(directory){
+  // Hash of the python code (every .py file in directory), so that cached simulations aren't replayed once the model
+  // or its default params have changed. Read once, when the app starts
+  const hash = crypto.createHash('sha1');
+  fs.readdirSync(directory).filter((f) => f.endsWith('.py')).sort().forEach((f) => {
+    hash.update(f + '\n').update(fs.readFileSync(path.join(directory, f))).update('\n');
+  });
+  return hash.digest('hex');
+}
+
+exports.createCache = function(directory, max_bytes, fingerprint=null){
+  // max_bytes: 0 = no caching; fingerprint: of the code that runs the simulations (see sourceFingerprint)
+  // (get, put and prune return promises, so that reading and writing files doesn't hold up other requests)
+  return {
+    key: function(params, seed){
+      return crypto.createHash('sha1').update(canonical({version: CACHE_VERSION, code: fingerprint, params: params, seed: seed})).digest('hex');
+    },
+    get: async function(key){
+      // OUTPUT: the simulation's frames, or null if not cached
+      if(max_bytes == 0){
+        return null;
+      }
+      const file = path.join(directory, key + '.gz');
+      try {
+        const frames = (await gunzip(await fs.promises.readFile(file))).toString().split('\n');
+        const now = new Date();
+        await fs.promises.utimes(file, now, now);
+        return frames;
+      } catch(err) {
+        return null;
+      }
+    },
+    put: async function(key, frames){
+      if(max_bytes == 0){
+        return;
+      }
+      await fs.promises.mkdir(directory, {recursive: true});
+      // write to a temporary file first, so that a half-written file is never read
+      const file = path.join(directory, key + '.gz');
+      const temp = file + '.' + process.pid + '.' + crypto.randomBytes(4).toString('hex') + '.tmp';
+      await fs.promises.writeFile(temp, await gzip(frames.join('\n')));
+      await fs.promises.rename(temp, file);
+      await this.prune();
+    },
+    prune: async function(){
+      // Remove least recently used simulations until the cache is no bigger than max_bytes
+      // (files removed by another prune in the meantime are skipped)
+      const files = (await fs.promises.readdir(directory)).filter((f) => f.endsWith('.gz'));
+      let entries = [];
+      for(const f of files){
+        try {
+          const stat = await fs.promises.stat(path.join(directory, f));
+          entries.push({file: path.join(directory, f), size: stat.size, used: stat.mtimeMs});
+        } catch(err) {
+          continue;
+        }
+      }
+      entries.sort((a, b) => a.used - b.used);
+      let total = entries.reduce((sum, e) => sum + e.size, 0);
+      for(const entry of entries){
+        if(total <= max_bytes){
+          break;
+        }
+        await fs.promises.unlink(entry.file).catch(() => {});
+        total -= entry.size;
+      }
+    }
+  };
+}
@@ -2,16 +2,20 @@
 // Initiate data and then update
 
 var animation_speed = 50;
+var frame_state = {};
 
 function cycle(data, iteration){
     // clear old
     svg.selectAll('circle').remove();
     svg.selectAll('path').remove();
-    // filter data for this iteration
-    points = data[iteration].landscape;
-    agents = data[iteration].population;
-    // set color for first iteration
+    // decode the frame for this iteration (frames are played in order, starting from the first, which has the whole landscape)
+    decodeFrame(data[iteration], frame_state);
+    points = frame_state.points;
+    agents = frame_state.agents;
+    // set grid size and color for first iteration
     if(iteration==0){
+      j = frameHeader(data[0]).x_size;
+      surface.shape('SURFACE', j);
       var yMin = d3.min(points, function(d){ return d.y; });
       var yMax = d3.max(points, function(d){ return d.y; });
       altitude_color.domain([yMin, yMax]);
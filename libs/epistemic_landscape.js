@@ -1,6 +1,6 @@
 // based on https://bl.ocks.org/Niekes/e920c03edd7950578b8a6cded8b5a1a5
 var origin = [520, 520];
-var j = Math.pow(data[0].landscape.length, 0.5);
+var j; // number of rows in the grid: set from the first frame (see cycle())
 var alpha = 0;
 var beta = 0;
 var hover_offset = 0.1;
@@ -42,6 +42,58 @@ var point3d = d3._3d()
 var altitude_color = d3.scaleLinear();
 var visited_color = d3.scaleLinear();
 
+// Decoding frames from the python script (see python/frames.py for the format)
+// Each frame is base64 text; the first one has the whole landscape, later ones only the patches that have changed
+
+function frameBuffer(frame){
+    var bytes = atob(frame);
+    var buffer = new Uint8Array(bytes.length);
+    for(var i=0; i<bytes.length; i++){
+        buffer[i] = bytes.charCodeAt(i);
+    }
+    return buffer.buffer;
+}
+
+function frameHeader(frame){
+    var header = new Int32Array(frameBuffer(frame), 0, 6);
+    return {kind: header[0], timestep: header[1], x_size: header[2], y_size: header[3], patches: header[4], agents: header[5]};
+}
+
+function decodeFrame(frame, state){
+    // Updates state.points (the landscape) in place and replaces state.agents
+    // (as lists of {x, y, z, ...}, with y as height and the center of the grid at (0,0))
+    var buffer = frameBuffer(frame);
+    var header = new Int32Array(buffer, 0, 6);
+    var kind = header[0], x_size = header[2], y_size = header[3], n = header[4], a = header[5];
+    var offset = 24;
+    var next = function(type, length){
+        var array = new type(buffer, offset, length);
+        offset += 4*length;
+        return array;
+    };
+    var indices = kind==1 ? next(Int32Array, n) : null;
+    var heights = next(Float32Array, n);
+    var visited = next(Int32Array, n);
+    if(kind==0){
+        state.points = [];
+        for(var i=0; i<n; i++){
+            state.points.push({x: Math.floor(i/y_size)-x_size/2, z: i%y_size-y_size/2, y: heights[i], visited: visited[i]});
+        }
+    } else {
+        for(var i=0; i<n; i++){
+            var point = state.points[indices[i]];
+            point.y = heights[i];
+            point.visited = visited[i];
+        }
+    }
+    var agent_x = next(Float32Array, a), agent_y = next(Float32Array, a), agent_height = next(Float32Array, a), agent_status = next(Int32Array, a);
+    state.agents = [];
+    for(var i=0; i<a; i++){
+        state.agents.push({x: agent_x[i]-x_size/2, z: agent_y[i]-y_size/2, y: agent_height[i], status: agent_status[i]});
+    }
+    return state;
+}
+
 // Updating landscape/agents at each time step
 
 function processLandscape(data){
@@ -0,0 +1,255 @@
+// A pool of long-lived python processes (python/worker.py) for running simulations
+// Python (and numpy etc.) only has to start up once per worker, rather than once per simulation.
+// Jobs are queued until a worker is free; a job that takes too long has its worker killed (and replaced);
+// and each worker is replaced after a number of jobs, so that no python process lives forever
+const { spawn } = require('child_process');
+const readline = require('readline');
+
+exports.createPool = function(options={}){
+  // size: max number of simulations running at once
+  // timeout: ms before a job is abandoned
+  // jobs_per_worker: jobs a worker does before being replaced
+  // max_queue: max number of jobs waiting for a worker (beyond this, jobs are rejected straight away)
+  // max_pause: ms a job can stay paused (see run's onFrame) before it's abandoned
+  const size = options.size || 2;
+  const timeout = options.timeout || 60000;
+  const jobs_per_worker = options.jobs_per_worker || 100;
+  const max_queue = options.max_queue || 100;
+  const max_pause = options.max_pause || timeout;
+
+  let workers = [];
+  let queue = [];
+
+  function startWorker(){
+    // (python/worker.py imports from the python folder, so it's run from there)
+    const pyprog = spawn('python3', ['worker.py'], {cwd: __dirname + '/../python'});
+    const worker = {pyprog: pyprog, job: null, jobs_done: 0, alive: true, ready: false, pending: []};
+    worker.lines = readline.createInterface({input: pyprog.stdout});
+    worker.lines.on('line', function(line){
+      // (readline can still pass on lines it had already read after being paused: these wait until the job resumes)
+      if(worker.pending.length > 0 || isPaused(worker)){
+        worker.pending.push(line);
+      } else {
+        handleLine(worker, line);
+      }
+    });
+    pyprog.stderr.on('data', (data) => {
+      console.log("Python error!", data.toString());
+    });
+    pyprog.on('exit', () => {
+      workerGone(worker, new Error("python worker exited during job"));
+    });
+    pyprog.on('error', (err) => {
+      // e.g. python3 can't be started (ENOENT, EACCES): without a handler, this would crash the whole server
+      console.log("Node: python worker error", err.message);
+      workerGone(worker, new Error("python worker failed: " + err.message));
+    });
+    pyprog.stdin.on('error', () => {
+      // (writing to a worker that has died: dealt with by the handlers above)
+    });
+    workers.push(worker);
+    return worker;
+  }
+
+  function workerGone(worker, err){
+    // The worker has exited, or couldn't be started: its job (if any) fails
+    // (both 'error' and 'exit' can happen for the same worker, so this can be called twice)
+    worker.alive = false;
+    workers = workers.filter((w) => w !== worker);
+    if(worker.job){
+      finishJob(worker, err);
+    }
+    next();
+  }
+
+  function handleLine(worker, line){
+    if(line.length==0){
+      return;
+    }
+    let d;
+    try {
+      d = JSON.parse(line);
+    } catch(err) {
+      // e.g. a stray print from python
+      console.log(line);
+      return;
+    }
+    const job = worker.job;
+    if(d.type=="ready"){
+      worker.ready = true;
+      if(job){
+        startTimer(worker);
+      }
+    } else if(!job){
+      return;
+    } else if(d.type=="message"){
+      console.log(d.data);
+    } else if (d.type=="frame"){
+      if(job.onFrame){
+        // streaming: frames are passed on straight away, rather than kept
+        const wait = job.onFrame(d.data);
+        if(wait && !job.paused){
+          pause(worker, job, wait);
+        }
+      } else {
+        job.frames.push(d.data);
+      }
+    } else if (d.type=="done"){
+      finishJob(worker, null);
+    } else if (d.type=="error"){
+      finishJob(worker, new Error(d.data));
+    }
+  }
+
+  function pause(worker, job, wait){
+    // Backpressure: stop reading from python until `wait` (a promise) resolves; python then blocks as soon as
+    // the pipe is full, so the simulation waits for whoever is receiving the frames
+    // (the timeout doesn't count while paused, but a job can only stay paused for max_pause)
+    job.paused = true;
+    stopTimer(job);
+    job.timer = setTimeout(() => kill(worker, "Node: python job paused for too long, restarting worker..."), max_pause);
+    worker.lines.pause();
+    const resume = () => {
+      job.paused = false;
+      if(worker.job === job){
+        clearTimeout(job.timer);
+        startTimer(worker, job.time_left);
+        handlePending(worker);
+      }
+    };
+    wait.then(resume, resume);
+  }
+
+  function isPaused(worker){
+    return worker.job !== null && worker.job.paused;
+  }
+
+  function handlePending(worker){
+    // Pass on the lines that arrived while paused, in order, then carry on reading (unless paused again)
+    while(worker.pending.length > 0 && !isPaused(worker)){
+      handleLine(worker, worker.pending.shift());
+    }
+    if(!isPaused(worker)){
+      worker.lines.resume();
+    }
+  }
+
+  function finishJob(worker, err){
+    const job = worker.job;
+    worker.job = null;
+    worker.jobs_done += 1;
+    clearTimeout(job.timer);
+    if(job.signal){
+      job.signal.removeEventListener('abort', job.abort);
+    }
+    if(err){
+      job.reject(err);
+    } else {
+      job.resolve(job.frames);
+    }
+    if(worker.alive && worker.jobs_done >= jobs_per_worker){
+      // recycle: finish this worker off (it's replaced when next needed)
+      retire(worker);
+    }
+    next();
+  }
+
+  function retire(worker){
+    worker.alive = false;
+    workers = workers.filter((w) => w !== worker);
+    worker.pyprog.stdin.end();
+  }
+
+  function next(){
+    // Start queued jobs on idle workers, starting new workers if there's room
+    while(queue.length > 0){
+      let worker = workers.find((w) => w.alive && !w.job);
+      if(!worker){
+        if(workers.length >= size){
+          return;
+        }
+        worker = startWorker();
+      }
+      const job = queue.shift();
+      worker.job = job;
+      // (a new worker reads the job once it has started up; the timeout only counts from then)
+      if(worker.ready){
+        startTimer(worker);
+      }
+      worker.pyprog.stdin.write(JSON.stringify({params: job.params, seed: job.seed}) + '\n');
+    }
+  }
+
+  function startTimer(worker, ms=timeout){
+    // ms: time the job has left
+    const job = worker.job;
+    job.time_left = ms;
+    job.timer_started = Date.now();
+    job.timer = setTimeout(() => kill(worker, "Node: python job timed out, restarting worker..."), ms);
+  }
+
+  function stopTimer(job){
+    clearTimeout(job.timer);
+    job.time_left -= Date.now() - job.timer_started;
+  }
+
+  function kill(worker, message){
+    // (the job is rejected when the worker exits)
+    console.log(message);
+    worker.alive = false;
+    worker.pyprog.kill('SIGKILL');
+  }
+
+  return {
+    run: function(params={}, seed=null, options={}){
+      // OUTPUT: promise of the simulation's frames (see python/frames.py)
+      // options.onFrame: if given, each frame is passed to it as soon as python sends it (and the promise resolves with no frames);
+      // if it returns a promise, python is paused until that resolves
+      // options.signal: an AbortSignal for cancelling the job (e.g. if the browser goes away)
+      return new Promise(function(resolve, reject){
+        if(queue.length >= max_queue){
+          reject(new Error("too many simulations waiting"));
+          return;
+        }
+        const job = {params: params, seed: seed, frames: [], resolve: resolve, reject: reject,
+          onFrame: options.onFrame, signal: options.signal, paused: false};
+        if(job.signal){
+          if(job.signal.aborted){
+            reject(new Error("job cancelled"));
+            return;
+          }
+          job.abort = function(){
+            if(queue.includes(job)){
+              queue = queue.filter((j) => j !== job);
+              reject(new Error("job cancelled"));
+            } else {
+              const worker = workers.find((w) => w.job === job);
+              if(worker){
+                // (the job is rejected when the worker exits)
+                worker.alive = false;
+                worker.pyprog.kill('SIGKILL');
+              }
+            }
+          };
+          job.signal.addEventListener('abort', job.abort);
+        }
+        queue.push(job);
+        next();
+      });
+    },
+    warm: function(){
+      // Start all the workers now, rather than when they're first needed
+      while(workers.length < size){
+        startWorker();
+      }
+    },
+    close: function(){
+      queue.forEach((job) => job.reject(new Error("pool closed")));
+      queue = [];
+      workers.slice().forEach(retire);
+    },
+    stats: function(){
+      return {workers: workers.length, busy: workers.filter((w) => w.job).length, paused: workers.filter((w) => w.job && w.job.paused).length, queued: queue.length};
+    }
+  };
+}
@@ -1,50 +1,126 @@
-// Call a child process to run the python script
-const { spawn } = require('child_process');
+// Run the python simulation, using a pool of python workers (see libs/pool.js) that stay running between simulations
+// Finished simulations are cached (see libs/cache.js), and identical requests made while a simulation is running share it
+const os = require('os');
+const path = require('path');
+const { createPool } = require('./pool.js');
+const { createCache, sourceFingerprint } = require('./cache.js');
 
-exports.run_py = function(params={}){
-  let run = new Promise(function(resolve, reject) {
+// pool size and job timeout can be set with environment variables PYTHON_WORKERS and SIM_TIMEOUT (ms)
+const pool = createPool({
+  size: parseInt(process.env.PYTHON_WORKERS) || Math.min(4, os.cpus().length),
+  timeout: parseInt(process.env.SIM_TIMEOUT) || 60000
+});
+exports.pool = pool;
 
-      console.log("Node: python starting...");
+// cache directory and max size (bytes; 0 = no caching) can be set with SIM_CACHE and SIM_CACHE_SIZE
+// (cached simulations are only replayed while the python code is the same as when they were run)
+const cache = createCache(process.env.SIM_CACHE || path.join(__dirname, '..', 'data', 'sim_cache'),
+  process.env.SIM_CACHE_SIZE === undefined ? 200*10**6 : parseInt(process.env.SIM_CACHE_SIZE),
+  sourceFingerprint(path.join(__dirname, '..', 'python')));
+exports.cache = cache;
 
-      // arg 'browser' tells the pythons script that this is the source of the call
-      // arg 'time' tells the simulation to report every time step
-      const pyprog = spawn('python3', ['python/run_simulations.py', 'browser', 'time', JSON.stringify(params)]);
+// seed for requests that don't give one, so that repeated requests (e.g. for the default simulation) can be cached
+const DEFAULT_SEED = 0;
 
-      // add data to string for eventual passing to the front end
-      let python_out = '';
-      pyprog.stdout.on('data', function(data) {
-          python_out += data.toString();
-      });
-      pyprog.stdout.on('message', function(data) {
-          console.log(data);
-      });
+// simulations currently running, by cache key
+const running = {};
 
-      // handle errors
-      pyprog.stderr.on('data', (data) => {
-          console.log("Python error!", data.toString());
-          reject(data.toString());
-      });
+exports.run_py = function(params={}, seed=DEFAULT_SEED){
+  // resolves with the simulation's frames, one per time step, for passing to the front end
+  let data = [];
+  return exports.stream_py(params, seed, (frame) => {
+    data.push(frame);
+  }).then(() => data);
+}
 
-      // at the end of the data stream, split the data into messages (--> console) and data (--> browser)
-      pyprog.stdout.on('end', () => {
-          console.log('Node: python end...');
-          var data = [];
-          python_out.split('\n').forEach(function(d,i){
-            if(d.length>0){
-              d = JSON.parse(d);
-              if(d.type=="message"){
-                console.log(d.data);
-              } else if (d.type=="data") {
-                data.push(JSON.parse(d.data));
-              }
-            }
-          });
-          resolve(data);
-      });
+exports.stream_py = function(params={}, seed=DEFAULT_SEED, onFrame, signal){
+  // Same as run_py, but passes each frame to onFrame as soon as it's available
+  // (if onFrame returns a promise, the simulation waits for it: see pool.js); signal (an AbortSignal) stops passing on frames
+  const key = cache.key(params, seed);
+
+  return cache.get(key).then((cached) => {
+    if(cached){
+      console.log("Node: replaying cached simulation...");
+      return replay(cached, onFrame, signal);
+    }
+
+    if(!running[key]){
+      running[key] = startSimulation(key, params, seed);
+    } else {
+      console.log("Node: joining running simulation...");
+    }
+    return running[key].subscribe(onFrame, signal);
+  });
+}
+
+async function replay(frames, onFrame, signal){
+  for(const frame of frames){
+    if(signal && signal.aborted){
+      return;
+    }
+    const wait = onFrame(frame);
+    if(wait){
+      await wait;
+    }
+  }
+}
 
-  }).catch((err)=>{
-    console.log("runsim error!", err);
+function startSimulation(key, params, seed){
+  // One simulation, with any number of subscribers: each gets all the frames, however late it joins.
+  // The simulation goes at the pace of the slowest subscriber, and is cancelled if all of them go away
+  const frames = [];
+  const subscribers = new Set();
+  const controller = new AbortController();
+  console.log("Node: python starting...");
+
+  const done = pool.run(params, seed, {signal: controller.signal, onFrame: (frame) => {
+    frames.push(frame);
+    const waits = [];
+    subscribers.forEach((subscriber) => {
+      const wait = subscriber.onFrame(frame);
+      if(wait){
+        waits.push(wait);
+      }
+    });
+    if(waits.length > 0){
+      return Promise.all(waits);
+    }
+  }}).then(() => {
+    console.log('Node: python end...');
+  });
+  // (requests for the same simulation keep joining this one until it's in the cache)
+  done.then(() => cache.put(key, frames).catch((err) => {
+    console.log("Node: couldn't cache simulation", err.message);
+  }), () => {}).finally(() => {
+    delete running[key];
   });
 
-  return run
+  return {
+    subscribe: function(onFrame, signal){
+      // (a subscriber that goes away stops holding up the simulation)
+      const gone = signal ? new Promise((resolve) => signal.addEventListener('abort', resolve)) : null;
+      const subscriber = {onFrame: (frame) => {
+        const wait = onFrame(frame);
+        return (wait && gone) ? Promise.race([wait, gone]) : wait;
+      }};
+      // catch up on the frames so far, then get the rest as they come
+      frames.forEach((frame) => onFrame(frame));
+      subscribers.add(subscriber);
+      if(signal){
+        gone.then(() => {
+          subscribers.delete(subscriber);
+          if(subscribers.size == 0){
+            controller.abort();
+          }
+        });
+      }
+      return done.then(() => {
+        subscribers.delete(subscriber);
+      }).catch((err) => {
+        subscribers.delete(subscriber);
+        console.log("runsim error!", err.message);
+        throw err;
+      });
+    }
+  };
 }
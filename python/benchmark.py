@@ -0,0 +1,157 @@
+# Speed benchmarks, from the landscape and population kernels up to whole runs and a small sweep
+# (see importtime.py for start-up time). Everything is seeded, so each benchmark does exactly the same work every time.
+# Usage:
+# `python3 benchmark.py --json benchmark.json` to run the benchmarks and save the results as json
+# `python3 benchmark.py compare baseline.json [current.json]` to compare against a baseline (running the benchmarks now if there's no current.json)
+# Options: --quick (smaller maps and populations only, one repeat), --tolerance 0.1 (how much slower counts as a regression)
+# compare exits with status 1 if anything got slower, so it can be used to check a change before using it for a real sweep
+
+import sys, os, json, time, platform, tempfile, itertools, concurrent.futures
+import numpy as np
+from simulation import Simulation, GlobalParams
+from landscape import Landscape
+import files, sweep
+
+MAP_SIZES = [40, 128, 512]
+AGENT_NUMBERS = [40, 400, 2000]
+QUICK_MAP_SIZES = [40, 128]
+QUICK_AGENT_NUMBERS = [40, 400]
+# benchmark runs are shorter than real ones: time per step hardly changes over a run
+TIMESTEPS = 100
+REPEATS = 3
+SEED = 1
+TOLERANCE = 0.1
+
+def bestOf(repeats, function):
+    # Fastest of several runs (the others are slowed down by whatever else the machine was doing)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return(min(times))
+
+def benchmarkParams(map_size, agent_number=GlobalParams.agent_number):
+    return({'map_size': map_size, 'agent_number': agent_number, 'timesteps': TIMESTEPS})
+
+def landscapeBenchmarks(map_size, repeats):
+    # Landscape.__init__ as a whole, and its hills and noise on their own
+    params = Simulation(GlobalParams, benchmarkParams(map_size), 'silent', 'basic').params
+    landscape = Landscape(params, np.random.default_rng(SEED))
+    if params.hill_number == 1:
+        hill_centers = np.array([0.5*map_size])
+    else:
+        hill_centers = np.arange(params.hill_number)*map_size/params.hill_number
+    timings = {
+        'landscape.init': bestOf(repeats, lambda: Landscape(params, np.random.default_rng(SEED))),
+        'landscape.gaussian': bestOf(repeats, lambda: landscape.addGaussian(hill_centers, hill_centers, params.hill_width/params.noise*1000, params.hill_width)),
+        'landscape.perlin': bestOf(repeats, lambda: landscape.addPerlin(params.noise, params.smoothing, params.octaves, np.random.default_rng(SEED))),
+    }
+    return([{'benchmark': name, 'map_size': map_size, 'seconds': seconds} for name, seconds in timings.items()])
+
+def populationBenchmarks(map_size, agent_number, repeats):
+    # Time per timestep of each step of Simulation.run (fastest of the repeats, each a whole run)
+    phases = ['updateData', 'move', 'decide', 'work']
+    best = {phase: float('inf') for phase in phases}
+    for _ in range(repeats):
+        simulation = Simulation(GlobalParams, benchmarkParams(map_size, agent_number), 'silent', 'time', SEED)
+        simulation.setUp()
+        population = simulation.population
+        steps = {'updateData': simulation.updateData, 'move': lambda timestep: population.move(),
+            'decide': lambda timestep: population.decide(simulation.params.timesteps), 'work': lambda timestep: population.work()}
+        totals = {phase: 0 for phase in phases}
+        for timestep in range(simulation.params.timesteps):
+            for phase in phases:
+                start = time.perf_counter()
+                steps[phase](timestep)
+                totals[phase] += time.perf_counter() - start
+        for phase in phases:
+            best[phase] = min(best[phase], totals[phase]/simulation.params.timesteps)
+    return([{'benchmark': 'step.' + phase, 'map_size': map_size, 'agent_number': agent_number, 'seconds': best[phase]} for phase in phases])
+
+def runBenchmark(map_size, agent_number, repeats):
+    # One whole run, including setting up the landscape and population
+    def run():
+        Simulation(GlobalParams, benchmarkParams(map_size, agent_number), 'silent', 'time', SEED).run()
+    return([{'benchmark': 'simulation.run', 'map_size': map_size, 'agent_number': agent_number, 'seconds': bestOf(repeats, run)}])
+
+def sweepBenchmark(repeats, runs=16, workers=2):
+    # A small sweep, done the same way as run_simulations.py (worker processes, results saved as npz chunks)
+    sim_parameters = {'tolerance': [0, 0.3], 'social_threshold_type': ['homogeneous', 'heterogeneous']}
+    combos = [dict(zip(sim_parameters, combination), **benchmarkParams(GlobalParams.map_size)) for combination in itertools.product(*sim_parameters.values())]
+    tasks = [(i % len(combos), [i], [SEED + i]) for i in range(runs)]
+    def run():
+        with tempfile.TemporaryDirectory() as directory:
+            writer = files.ResultWriter({'data': (os.path.join(directory, 'data'), files.get_data_headers(sim_parameters))},
+                os.path.join(directory, 'done.txt'))
+            with concurrent.futures.ProcessPoolExecutor(workers, initializer=sweep.initWorker, initargs=(GlobalParams, combos, 'basic')) as executor:
+                for task, (results, task_time) in zip(tasks, executor.map(sweep.runTask, tasks, chunksize=sweep.chunkSize(len(tasks), workers))):
+                    writer.add(results, task[1])
+            writer.close()
+    return([{'benchmark': 'sweep', 'runs': runs, 'workers': workers, 'seconds': bestOf(repeats, run)}])
+
+def runBenchmarks(quick=False):
+    map_sizes = QUICK_MAP_SIZES if quick else MAP_SIZES
+    agent_numbers = QUICK_AGENT_NUMBERS if quick else AGENT_NUMBERS
+    repeats = 1 if quick else REPEATS
+    results = []
+    def record(new_results):
+        for result in new_results:
+            print('{}: {}'.format(benchmarkName(result), formatSeconds(result['seconds'])))
+        sys.stdout.flush()
+        results.extend(new_results)
+    for map_size in map_sizes:
+        record(landscapeBenchmarks(map_size, repeats))
+    for map_size, agent_number in itertools.product(map_sizes, agent_numbers):
+        record(populationBenchmarks(map_size, agent_number, repeats))
+        record(runBenchmark(map_size, agent_number, repeats))
+    record(sweepBenchmark(repeats))
+    return({'python': sys.version.split()[0], 'numpy': np.__version__, 'machine': platform.platform(), 'cpus': os.cpu_count(),
+        'timesteps': TIMESTEPS, 'seed': SEED, 'quick': quick, 'results': results})
+
+def benchmarkName(result):
+    # e.g. 'step.move map_size=128 agent_number=400'
+    return(' '.join([result['benchmark']] + ['{}={}'.format(key, value) for key, value in result.items() if key not in ['benchmark', 'seconds']]))
+
+def formatSeconds(seconds):
+    return('{:.2f}s'.format(seconds) if seconds >= 1 else '{:.2f}ms'.format(1000*seconds))
+
+def compare(baseline, current, tolerance=TOLERANCE):
+    # OUTPUT: names of the benchmarks that are more than tolerance slower than in the baseline
+    if (baseline['machine'], baseline['python'], baseline['numpy']) != (current['machine'], current['python'], current['numpy']):
+        print('warning: baseline is from {machine} (python {python}, numpy {numpy}); timings may not be comparable'.format(**baseline))
+    baseline_seconds = {benchmarkName(result): result['seconds'] for result in baseline['results']}
+    slower = []
+    for result in current['results']:
+        name = benchmarkName(result)
+        if name not in baseline_seconds:
+            continue
+        ratio = result['seconds']/baseline_seconds[name]
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  SLOWER'
+            slower.append(name)
+        elif ratio < 1 - tolerance:
+            flag = '  faster'
+        print('{}: {} -> {} (x{:.2f}){}'.format(name, formatSeconds(baseline_seconds[name]), formatSeconds(result['seconds']), ratio, flag))
+    return(slower)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    quick = '--quick' in args
+    tolerance = float(args[args.index('--tolerance') + 1]) if '--tolerance' in args else TOLERANCE
+    if len(args) > 0 and args[0] == 'compare':
+        with open(args[1]) as f:
+            baseline = json.load(f)
+        if len(args) > 2 and not args[2].startswith('--'):
+            with open(args[2]) as f:
+                current = json.load(f)
+        else:
+            current = runBenchmarks(quick or baseline.get('quick', False))
+        slower = compare(baseline, current, tolerance)
+        print('{} benchmark(s) more than {:.0%} slower than the baseline'.format(len(slower), tolerance))
+        sys.exit(1 if len(slower) > 0 else 0)
+    results = runBenchmarks(quick)
+    if '--json' in args:
+        with open(args[args.index('--json') + 1], 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,165 @@
+# Classes for running several replicates of the same parameter settings at once, as one array program.
+# Each replicate has its own landscape and population, but these are stacked into single arrays
+# so that each timestep's move/decide/work is done for all replicates together,
+# spreading the per-step Python overhead over all of them.
+# The ensembleRun() function below is the ensemble version of simulation.singleRun()
+
+from landscape import Landscape
+from population import Population
+from simulation import Simulation
+import files
+import numpy as np
+
+class StackedLandscape(Landscape):
+    """
+    Several landscapes of the same size, stacked along x:
+    patch (x,y) of replicate k is at [k*x_size + x, y] in the height and visited arrays
+    """
+
+    def __init__(self, landscapes):
+        self.replicates = len(landscapes)
+        self.x_size = landscapes[0].x_size
+        self.y_size = landscapes[0].y_size
+        self.sig_threshold = landscapes[0].sig_threshold
+        self.mooreArray = landscapes[0].mooreArray
+        self.mooreIndList = landscapes[0].mooreIndList
+        self.mooreOffsets = landscapes[0].mooreOffsets
+
+        self.height = np.concatenate([landscape.height for landscape in landscapes])
+        self.visited = np.concatenate([landscape.visited for landscape in landscapes])
+        # epistemic mass is tracked with one region per replicate
+        self.region_rows = self.x_size
+        self.check_mass = landscapes[0].check_mass
+        self.resetMass()
+
+        # LANDSCAPE GLOBAL PROPERTIES (one per replicate)
+        self.total_epistemic_mass = np.array([landscape.total_epistemic_mass for landscape in landscapes])
+        self.max_height = np.array([landscape.max_height for landscape in landscapes])
+
+    def replicateHeights(self):
+        # heights as a (replicates, x_size, y_size) array
+        return self.height.reshape(self.replicates, self.x_size, self.y_size)
+
+    def epistemicMass(self):
+        # Current epistemic mass remaining in each replicate (each the same as Landscape.epistemicMass)
+        return self.regionMass()
+
+    def epistemicMassDiscovered(self):
+        return np.round(1 - self.epistemicMass()/self.total_epistemic_mass, 3)
+
+class StackedPopulation(Population):
+    """
+    Several populations of the same size, stacked into one agents array (replicate k is agents k*agent_number onwards),
+    each moving on its own landscape in a StackedLandscape
+    """
+
+    def __init__(self, landscape, populations):
+        self.landscape = landscape
+        self.replicates = len(populations)
+        self.agent_number = populations[0].agent_number
+        self.decide_mode = populations[0].decide_mode
+        self.work_mode = populations[0].work_mode
+        self.social_radius = populations[0].social_radius
+        self.kernel_backend = populations[0].kernel_backend
+        self.setKernels()
+        if self.decide_mode != 'batched' or self.work_mode == 'reference':
+            raise Exception("Ensembles need the batched decide_mode and work_mode")
+
+        # each replicate keeps drawing from its own generator, so replicate k follows the same trajectory
+        # as a Simulation with the same seed
+        self.rngs = [population.rng for population in populations]
+        self.agents = np.concatenate([population.agents for population in populations])
+        self.visited_bits = np.concatenate([population.visited_bits for population in populations])
+        self.setAdjustmentTable()
+
+        # where each agent's landscape and replicate start (see Population.__init__)
+        replicate = np.repeat(np.arange(self.replicates), self.agent_number)
+        self.landscape_row = replicate*landscape.x_size
+        self.first_agent = replicate*self.agent_number
+        if self.social_radius is not None:
+            self.buildSpatialIndex()
+
+    def agentRng(self, i):
+        return self.rngs[i // self.agent_number]
+
+    def reportSuccess(self):
+        # One dict of agent outcomes per replicate
+        return [Population.reportSuccess(self, slice(k*self.agent_number, (k+1)*self.agent_number)) for k in range(self.replicates)]
+
+    def allLost(self):
+        # For each replicate: is every agent completely lost?
+        return np.all(self.agents['status'].reshape(self.replicates, self.agent_number) == 3, axis=1)
+
+class Ensemble(Simulation):
+    """
+    Several replicate runs with the same global and run-specific parameters, advanced together
+    """
+    def __init__(self, global_params, run_params, seeds, detail):
+        # seeds: one per replicate (see Simulation)
+        super().__init__(global_params, run_params, 'silent', detail)
+        self.seeds = seeds
+        self.replicates = len(seeds)
+
+    def setUp(self):
+        self.group_data = [{} for k in range(self.replicates)]
+        self.agent_data = [[] for k in range(self.replicates)]
+        rngs = [np.random.default_rng(seed) for seed in self.seeds]
+        landscapes = [Landscape(self.params, rng) for rng in rngs]
+        populations = [Population(landscape, self.params, rng) for landscape, rng in zip(landscapes, rngs)]
+        self.landscape = StackedLandscape(landscapes)
+        self.population = StackedPopulation(self.landscape, populations)
+        # timestep at which each replicate stopped early (-1 = still going)
+        self.stopped_at = np.full(self.replicates, -1)
+
+    def updateData(self, timestep):
+        # (replicates that have stopped early already have all their data)
+        running = np.flatnonzero(self.stopped_at < 0)
+        if self.reportsteps or timestep==self.params.timesteps-1:
+            mass = self.landscape.epistemicMassDiscovered()
+            for k in running:
+                self.group_data[k][timestep] = {'timestep': timestep, 'mass': mass[k]}
+        if self.reportagents and timestep==self.params.timesteps-1:
+            agent_data = self.population.reportSuccess()
+            for k in running:
+                self.agent_data[k] = agent_data[k]
+
+    def stopEarly(self, timestep):
+        # Each replicate stops (i.e. its data is filled in) as soon as it meets a stopping criterion, as it would on its own;
+        # the ensemble as a whole stops once they all have
+        stopping = np.flatnonzero(np.logical_and(self.stoppingCriteria(), self.stopped_at < 0))
+        if timestep == self.params.timesteps-1:
+            return False
+        if len(stopping) > 0:
+            mass = self.landscape.epistemicMassDiscovered()
+            agent_data = self.population.reportSuccess() if self.reportagents else None
+            for k in stopping:
+                self.stopped_at[k] = timestep
+                self.group_data[k].update(self.remainingRows(timestep, mass[k]))
+                if self.reportagents:
+                    self.agent_data[k] = agent_data[k]
+        return bool(np.all(self.stopped_at >= 0))
+
+    def collectData(self, sim_numbers, details='time'):
+        # Same as Simulation.collectData, for each replicate in turn (with its own sim number)
+        if details in ['time', 'basic']:
+            data = self.group_data
+        elif details =='agents':
+            data = self.agent_data
+        elif details == 'profile':
+            # (one profile for the whole ensemble, saved with the first replicate's sim number and the number of replicates)
+            return self.formatData(self.profiler.rows(self.replicates), sim_numbers[0], self.seeds[0], decimals=None)
+        else:
+            raise Exception("details arg not recognised (choose from: 'time', 'agents', 'basic', 'profile')")
+        import pandas as pd
+        return pd.concat([self.formatData(data[k], sim_number, self.seeds[k]) for k, sim_number in enumerate(sim_numbers)])
+
+def ensembleRun(inputs):
+    glob, loc, sim_numbers, seeds, detail = inputs
+    ensemble = Ensemble(glob, loc, seeds, detail)
+    ensemble.run()
+    results = {'data': files.result_columns(ensemble.collectData(sim_numbers))}
+    if detail == 'agents':
+        results['agents'] = files.result_columns(ensemble.collectData(sim_numbers, 'agents'))
+    if ensemble.params.profile:
+        results['profile'] = files.result_columns(ensemble.collectData(sim_numbers, 'profile'))
+    return(results)
@@ -1,21 +1,28 @@
 # Functions for handling data files
 # It assumes data files are stored in `../data`
-import os, re
+import os, re, json, glob, tempfile, time
+import numpy as np
 
-def fileSuffix(sim_type):
+def fileSuffix(sim_type, resume=False):
     # If this is a test run, save data to "data_temp.csv".
     # Otherwise, see how many data files are in directory, and increment to get new ID
+    # (or, if resuming a 'run', get the ID of the latest one)
     if sim_type == 'test':
         return("_temp")
     elif sim_type == 'run':
         max_id = 0
         if os.path.exists("../data/"):
             for file in os.listdir("../data/"):
-                files = re.search('data([0-9]+).csv', file)
+                # (every sweep has a param file, whatever format its data is saved in)
+                files = re.search('param([0-9]+).json', file)
                 if files:
                     file_id = int(files.group(1))
                     if file_id > max_id:
                         max_id = file_id
+        if resume:
+            if max_id == 0:
+                raise Exception("No sweep to resume in ../data/")
+            return(max_id)
         return(max_id + 1)
     else:
         numbers = re.search('([0-9]+)', sim_type)
@@ -29,7 +36,7 @@ def get_data_headers(sim_parameters, agent_columns_to_get=[]):
     # Is this looking for group-level or agent-level data?
     if len(agent_columns_to_get)==0:
         # group-level data only
-        headers = 'timestep,mass,sim'
+        headers = 'timestep,mass,sim,seed'
     else:
         # agent-level data
         headers = ','.join(agent_columns_to_get)
@@ -47,3 +54,172 @@ def get_sim_headers(sim_parameters):
         else:
             headers += param + '\n'
     return(headers)
+
+
+# Sweep progress: a manifest of every task in a sweep, and a record of which sims have finished
+
+def write_manifest(manifest_file, manifest):
+    # (written to a temporary file first, as an adaptive sweep rewrites its manifest after each round)
+    temp_file = manifest_file + '.tmp'
+    with open(temp_file, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temp_file, manifest_file)
+
+def read_manifest(manifest_file):
+    with open(manifest_file) as f:
+        return(json.load(f))
+
+def log_done(done_file, sims):
+    # Append finished sim numbers, one per line (flushed straight away so they survive the process being killed)
+    with open(done_file, "a") as f:
+        f.write(''.join('{}\n'.format(sim) for sim in sims))
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_done(done_file):
+    done = set()
+    if os.path.exists(done_file):
+        with open(done_file) as f:
+            for line in f:
+                # ignore a half-written last line
+                if line.endswith('\n'):
+                    done.add(int(line))
+    return(done)
+
+def drop_unfinished(data_file, done):
+    # Remove rows from sims that aren't in `done` (e.g. written just before a crash, but not recorded as finished)
+    if not data_file.endswith('.csv'):
+        for chunk_file in chunk_files(data_file):
+            with np.load(chunk_file) as chunk:
+                columns = {name: chunk[name] for name in chunk.files}
+            finished = np.isin(columns['sim'], list(done))
+            if not finished.all():
+                save_chunk(chunk_file, {name: column[finished] for name, column in columns.items()})
+        return
+    with open(data_file) as f:
+        lines = f.readlines()
+    # (the sim column is found by counting from the end of the row, since the sim, seed and param columns are always last)
+    headers = lines[0].rstrip('\n').split(',')
+    sim_column = headers.index('sim') - len(headers)
+    kept = [lines[0]]
+    for line in lines[1:]:
+        fields = line.rstrip('\n').split(',')
+        if line.endswith('\n') and len(fields) >= len(headers) and fields[sim_column].isdigit() and int(fields[sim_column]) in done:
+            kept.append(line)
+    with open(data_file, "w") as f:
+        f.writelines(kept)
+
+
+# Sweep output: runs send their results (as columns) back to the main process, where one ResultWriter saves them in batches.
+# Results are saved either as chunks of numpy arrays (data<id>.00000.npz, data<id>.00001.npz, ...; see load_results()),
+# or appended to a csv file
+
+def result_columns(data_frame):
+    # A run's data (see Simulation.collectData) as {column name: array}, which is much cheaper to send between processes than csv text
+    columns = {}
+    for name in data_frame.columns:
+        column = data_frame[name].to_numpy()
+        if column.dtype == object:
+            # e.g. strings, or params given as dicts: saved as text, as in the csv
+            column = column.astype(str)
+        columns[name] = column
+    return(columns)
+
+def chunk_files(data_stem):
+    return(sorted(glob.glob(glob.escape(data_stem) + '.[0-9]*.npz')))
+
+def save_chunk(chunk_file, columns):
+    # Write to a temporary file first, so that an interrupted sweep never leaves half a chunk
+    temp_file, temp_path = tempfile.mkstemp(dir=os.path.dirname(chunk_file) or '.', suffix='.npz')
+    with os.fdopen(temp_file, 'wb') as f:
+        np.savez(f, **columns)
+    os.replace(temp_path, chunk_file)
+
+def load_results(data_stem):
+    # All results saved so far for a sweep, as one dataframe (e.g. load_results('../data/data7'))
+    import pandas as pd
+    chunks = []
+    for chunk_file in chunk_files(data_stem):
+        with np.load(chunk_file) as chunk:
+            chunks.append(pd.DataFrame({name: chunk[name] for name in chunk.files}))
+    if len(chunks) == 0:
+        raise Exception("No results found for {}".format(data_stem))
+    return(pd.concat(chunks, ignore_index=True))
+
+def export_csv(data_stem, csv_file=None):
+    # Save a sweep's results as a single csv file (by default data<id>.csv, next to the chunks)
+    if csv_file is None:
+        csv_file = data_stem + '.csv'
+    load_results(data_stem).to_csv(csv_file, index=False)
+    return(csv_file)
+
+class ResultWriter():
+    """
+    Saves results from many runs, from a single process, in batches of about batch_rows rows
+    (or whatever has come in after flush_seconds, so that a long sweep doesn't lose much if it's interrupted)
+    """
+    def __init__(self, outputs, done_file, output_format='npz', batch_rows=100000, flush_seconds=60):
+        # outputs: {table name: (data_stem, headers)}, e.g. {'data': ('../data/data7', 'timestep,mass,...')}
+        # (headers: as returned by get_data_headers())
+        # done_file: finished sims are only recorded there once their results have been saved
+        if output_format not in ['npz', 'csv']:
+            raise Exception("output format not recognised (choose from: 'npz', 'csv')")
+        self.outputs = {name: (data_stem, headers.rstrip('\n').split(',')) for name, (data_stem, headers) in outputs.items()}
+        self.done_file = done_file
+        self.output_format = output_format
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.last_flush = time.time()
+        # carry on numbering chunks after any saved by an earlier (interrupted) attempt at this sweep
+        self.next_chunk = max([int(chunk_file.split('.')[-2]) + 1 for data_stem, headers in self.outputs.values() for chunk_file in chunk_files(data_stem)] + [0])
+        self.buffer = {name: [] for name in self.outputs}
+        self.buffered_rows = 0
+        self.buffered_sims = []
+
+    def add(self, results, sims):
+        # results: {table name: columns} for the sims in a finished task
+        for name in self.outputs:
+            self.buffer[name].append(results[name])
+        self.buffered_rows += max(self.rowCount(columns) for columns in results.values())
+        self.buffered_sims.extend(sims)
+        if self.buffered_rows >= self.batch_rows or time.time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.time()
+        if len(self.buffered_sims) == 0:
+            return
+        for name, (data_stem, headers) in self.outputs.items():
+            columns = {header: np.concatenate([self.getColumn(task, header) for task in self.buffer[name]]) for header in headers}
+            if self.output_format == 'npz':
+                save_chunk('{}.{:05d}.npz'.format(data_stem, self.next_chunk), columns)
+            else:
+                import pandas as pd
+                pd.DataFrame(columns).to_csv(data_stem + '.csv', mode="a", header=False, index=False)
+        self.next_chunk += 1
+        log_done(self.done_file, self.buffered_sims)
+        self.buffer = {name: [] for name in self.outputs}
+        self.buffered_rows = 0
+        self.buffered_sims = []
+
+    def rowCount(self, columns):
+        return(len(next(iter(columns.values()), [])))
+
+    def getColumn(self, columns, header):
+        # A column can be missing altogether, e.g. patches_visited if no agent moved: save it as missing values
+        if header in columns:
+            return(columns[header])
+        return(np.full(self.rowCount(columns), np.nan))
+
+    def close(self):
+        self.flush()
+
+
+if __name__ == "__main__":
+    # e.g. `python3 files.py csv ../data/data7` to save sweep 7's results (however many chunks) as ../data/data7.csv
+    import sys
+    if len(sys.argv) >= 3 and sys.argv[1] == 'csv':
+        for data_stem in sys.argv[2:]:
+            print('saved {}'.format(export_csv(data_stem)))
+    else:
+        print("usage: python3 files.py csv ../data/data<id> [../data/agents<id> ...]")
@@ -0,0 +1,49 @@
+# Binary frames for passing the state of a simulation to the node app (browser mode), one frame per timestep
+# The first frame has the whole landscape; after that, each frame only has the patches that have changed since the previous one.
+# Each frame is a sequence of little-endian 4-byte values (decoded by decodeFrame() in libs/epistemic_landscape.js):
+#   header (int32 x 6): kind (0: whole landscape, 1: changes only), timestep, x_size, y_size, number of patches n, number of agents a
+#   patch indices (int32 x n, changes only): x*y_size + y
+#   patch heights (float32 x n), patch visits (int32 x n)
+#   agent x, agent y, agent height (float32 x a each), agent status (int32 x a)
+
+import numpy as np
+
+KEYFRAME = 0
+DELTA = 1
+
+class FrameEncoder():
+    """
+    Encodes the landscape and agents at each timestep, keeping track of what has already been sent
+    """
+    def __init__(self):
+        self.sent_height = None
+        self.sent_visited = None
+
+    def encode(self, timestep, landscape, population):
+        # OUTPUT: the frame, as bytes
+        height = landscape.height.ravel().astype('<f4')
+        visited = landscape.visited.ravel().astype('<i4')
+        if self.sent_height is None:
+            kind = KEYFRAME
+            patches = slice(None)
+        else:
+            kind = DELTA
+            # (compared at the precision they are sent at, so changes too small to show aren't sent)
+            patches = np.flatnonzero((height != self.sent_height) | (visited != self.sent_visited)).astype('<i4')
+        self.sent_height = height
+        self.sent_visited = visited
+
+        agents = population.agents
+        agent_height = landscape.getSig(agents['x_patch'], agents['y_patch'])
+        header = np.array([kind, timestep, landscape.x_size, landscape.y_size, height[patches].size, len(agents)], dtype='<i4')
+        arrays = [header]
+        if kind == DELTA:
+            arrays.append(patches)
+        arrays += [height[patches], visited[patches],
+            agents['x'].astype('<f4'), agents['y'].astype('<f4'), agent_height.astype('<f4'), agents['status'].astype('<i4')]
+        return(b''.join(array.tobytes() for array in arrays))
+
+    def reset(self):
+        # Start again with a whole landscape in the next frame
+        self.sent_height = None
+        self.sent_visited = None
@@ -0,0 +1,42 @@
+# Import-time benchmark: how long it takes to import each entry point, in a fresh python process (using `python -X importtime`)
+# Start-up time matters most in browser mode, where it's paid by every python worker (see worker.py)
+# Usage: `python3 importtime.py` to print a summary, or `python3 importtime.py --json importtime.json` to also save it as json
+# (e.g. to compare before and after a change)
+
+import sys, json, subprocess
+
+ENTRY_POINTS = ['worker', 'simulation', 'sweep', 'run_simulations']
+# slow imports that should only happen on the code paths that need them
+HEAVY_MODULES = ['pandas', 'scipy.stats', 'scipy.special', 'tqdm', 'matplotlib']
+REPEATS = 5
+
+def importTimes(module):
+    # OUTPUT: {imported module: cumulative import time in microseconds} for one fresh import of module
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return(times)
+
+def benchmark(module, repeats=REPEATS):
+    # Best of several runs (the first run also warms up the file system cache)
+    runs = [importTimes(module) for _ in range(repeats)]
+    best = min(runs, key=lambda times: times[module])
+    return({'module': module,
+        'total_ms': round(best[module]/1000, 1),
+        'heavy_modules': [heavy for heavy in HEAVY_MODULES if heavy in best],
+        'slowest': [[name, round(us/1000, 1)] for name, us in sorted(best.items(), key=lambda item: -item[1])
+            if name != module and '.' not in name][:5]})
+
+if __name__ == "__main__":
+    results = [benchmark(module) for module in ENTRY_POINTS]
+    for result in results:
+        print('{module}: {total_ms}ms (heavy modules: {heavy})'.format(heavy=', '.join(result['heavy_modules']) or 'none', **result))
+        print('    slowest: ' + ', '.join('{} {}ms'.format(name, ms) for name, ms in result['slowest']))
+    if '--json' in sys.argv:
+        with open(sys.argv[sys.argv.index('--json') + 1], 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=4)
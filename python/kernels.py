@@ -0,0 +1,105 @@
+# Optional compiled versions (using numba, if it's installed) of the parts of a timestep that are loops over agents,
+# selected with GlobalParams.kernel_backend (see Population). The default 'numpy' backend doesn't use this module.
+# Each kernel must give exactly the same results as the numpy code it replaces, so that a run with a given seed
+# follows the same trajectory with either backend. So the kernels:
+# - use the same precision as the numpy code at every step (the agents array is float32, heights are usually float64),
+# - only use arithmetic that is exactly rounded (+ - * / sqrt, comparisons), not e.g. sin/cos/arctan, whose last bit can differ
+#   between numba and numpy (which is why moving and setting headings are left to numpy),
+# - don't draw any random numbers (those are drawn in the same order by both backends, from the run's generator)
+
+import sys
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Kernels compiled so far (each is compiled the first time it's used)
+compiled = {}
+# whether it's been said that numba isn't available
+warned = False
+
+def backend(requested):
+    # The backend to use: 'numba' if requested and available, otherwise 'numpy'
+    global warned
+    if requested not in ['numpy', 'numba']:
+        raise Exception("kernel_backend not recognised (choose from: 'numpy', 'numba')")
+    if requested == 'numba' and numba is None:
+        if not warned:
+            # (to stderr, since in browser mode stdout is for the node app; once per process)
+            print("numba isn't installed: using the numpy kernel backend", file=sys.stderr)
+            warned = True
+        return 'numpy'
+    return requested
+
+def kernel(function):
+    # The compiled version of function
+    # (error_model='numpy': dividing by zero gives inf/nan, as in numpy, rather than an exception)
+    if function.__name__ not in compiled:
+        compiled[function.__name__] = numba.njit(cache=True, error_model='numpy')(function)
+    return compiled[function.__name__]
+
+def depleteSequential(height, patch, limit, depletion_rate, sig_threshold, consumed):
+    """
+    Same as Population.workReference / workBatched (sequential), as one loop over agents in id order
+    INPUT: height: heights of the patches agents are on, updated in place; patch: each agent's patch (index into height)
+    limit: depletion_rate + sig_threshold for each agent (as computed by numpy); sig_threshold: of the same type as height
+    consumed: each agent's consumed, updated in place
+    """
+    for i in range(len(patch)):
+        current = height[patch[i]]
+        if current >= limit[i]:
+            height[patch[i]] = current - depletion_rate[i]
+        elif current > sig_threshold:
+            height[patch[i]] = sig_threshold
+        consumed[i] += current
+
+def maxLearnable(rows, first_agent, agent_number, agent_x, agent_y, agent_height, patch_popularity, below_significance,
+        adjustment_table, adjustment_row, current_heights, x_size, y_size):
+    """
+    Same as Population.checkMaxLearnableBatched (with everyone in the replicate a candidate), one focal agent at a time,
+    so without the (rows x agents) matrices. Inclines are worked out as in checkOthersValuesBatched
+    INPUT: x_size, y_size: as float32; current_heights: as float64
+    OUTPUT: max_learnable (-9999 if nobody to learn from), tie_counts, tie_candidates (flat array, in row order)
+    """
+    max_learnable = np.full(len(rows), -9999.0)
+    tie_counts = np.zeros(len(rows), dtype=np.int64)
+    tie_candidates = np.zeros(max(16, len(rows)), dtype=np.int64)
+    tie_total = 0
+    inclines = np.empty(agent_number)
+    for k in range(len(rows)):
+        focal = rows[k]
+        row_max = -np.inf
+        for j in range(agent_number):
+            other = first_agent[focal] + j
+            # toroidal distance (in float32)
+            dist_x1 = agent_x[other] - agent_x[focal]
+            dist_x2 = x_size - dist_x1
+            dist_y1 = agent_y[other] - agent_y[focal]
+            dist_y2 = y_size - dist_y1
+            dist_x = min(dist_x2, dist_x1)
+            dist_y = min(dist_y2, dist_y1)
+            distance = np.sqrt(dist_x*dist_x + dist_y*dist_y)
+            too_close = agent_x[other] == agent_x[focal] and agent_y[other] == agent_y[focal]
+            if too_close or below_significance[other]:
+                incline = -np.inf
+            else:
+                adjustment = adjustment_table[adjustment_row[focal], patch_popularity[other]]
+                others_height = np.float64(agent_height[other])*(1 - adjustment)
+                incline = (others_height - current_heights[focal]) / np.float64(distance)
+                if np.isnan(incline):
+                    incline = -np.inf
+            inclines[j] = incline
+            if incline > row_max:
+                row_max = incline
+        if row_max > -np.inf:
+            max_learnable[k] = row_max
+            for j in range(agent_number):
+                if inclines[j] == row_max:
+                    if tie_total == len(tie_candidates):
+                        tie_candidates = np.concatenate((tie_candidates, np.zeros(len(tie_candidates), dtype=np.int64)))
+                    tie_candidates[tie_total] = first_agent[focal] + j
+                    tie_total += 1
+                    tie_counts[k] += 1
+    return max_learnable, tie_counts, tie_candidates[:tie_total]
@@ -1,16 +1,19 @@
 from perlin import PerlinNoiseFactory
+from landscape_cache import LandscapeCache
 import numpy as np
-from scipy.stats import multivariate_normal
-from collections import defaultdict
 
 class Landscape():
     """
     Class describing the epistemic landscape consisting of a number of grid 'patches'
     """
 
-    def __init__(self,params):
+    def __init__(self,params,rng=None):
         """
         Required params: x_size,y_size,hills,hill_width,noise,smoothing
+        rng: numpy random Generator for this run (a fresh, unseeded one if not given)
+        Optional params: landscape_seed (the landscape is generated from this seed rather than from rng),
+        landscape_cache (directory in which to cache landscapes, requires landscape_seed),
+        check_mass (check the running total of epistemic mass against the whole grid whenever it's used)
         """
         self.x_size = params.map_size
         self.y_size = params.map_size
@@ -18,46 +21,89 @@ class Landscape():
 
         # GRID
         # Each patch in grid is defined by:
-        # x, y (int): coordinates
+        # x, y (int): coordinates (not stored; see coordinates())
         # height (float): epistemic value of the patch
-        # visited (int): number of times visited - NOT IMPLEMENTED YET
-        self.grid = np.zeros((self.x_size,self.y_size),
-            dtype = [('x', np.int8),
-                     ('y', np.int8),
-                     ('height', np.float64),
-                     ('visited', np.int8)])
-
-        # COORDINATES
-        self.grid['x'] = np.indices(self.grid.shape)[0]
-        self.grid['y'] = np.indices(self.grid.shape)[1]
+        # visited (int): number of different agents that have visited
+        # Each property is kept in its own contiguous (x_size, y_size) array
+        self.height = np.zeros((self.x_size,self.y_size), dtype=np.float64)
+        self.visited = np.zeros((self.x_size,self.y_size), dtype=np.int32)
 
         # MOORE NEIGHBORHOOD
         # data needed by getMooreNeighborhood to find the 8 patches surrounding a given patch
         self.mooreArray = np.zeros(8,dtype =[('x','i4'),('y','i4'),("height", 'f4'),("visited", 'i4')])
         self.mooreIndList = ((-1,-1),(-1,0),(-1,+1),(0,-1),(0,+1),(+1,-1),(+1,0),(+1,+1))
-
-        # HILLS
-        for i in range(params.hill_number):
+        self.mooreOffsets = np.array(self.mooreIndList)
+
+        # HEIGHTS
+        # Reuse a cached landscape if possible (only reproducible, i.e. seeded, landscapes can be cached)
+        cache = None
+        heights = None
+        if params.landscape_cache is not None and params.landscape_seed is not None:
+            cache = LandscapeCache(params.landscape_cache, params.landscape_cache_size)
+            heights = cache.load(params)
+
+        if heights is not None:
+            # copy out of the memory-mapped file, since agents deplete the landscape
+            self.height[:] = heights
+        else:
+            # HILLS
             if params.hill_number == 1:
-                hill_center_x = 0.5*params.map_size
-                hill_center_y = 0.5*params.map_size
+                hill_centers = np.array([0.5*params.map_size])
             else:
-                hill_center_x = i*params.map_size/params.hill_number
-                hill_center_y = i*params.map_size/params.hill_number
-            self.addGaussian(hill_center_x,hill_center_y,params.hill_width/params.noise*1000,params.hill_width)
+                hill_centers = np.arange(params.hill_number)*params.map_size/params.hill_number
+            self.addGaussian(hill_centers,hill_centers,params.hill_width/params.noise*1000,params.hill_width)
+
+            # NOISE
+            if params.landscape_seed is not None:
+                rng = np.random.default_rng(params.landscape_seed)
+            elif rng is None:
+                rng = np.random.default_rng()
+            self.addPerlin(params.noise, params.smoothing, params.octaves, rng)
 
-        # NOISE
-        self.addPerlin(params.noise, params.smoothing, params.octaves)
+            if cache is not None:
+                cache.store(params, self.height)
+
+        # heights are always generated (and cached) at double precision, then stored at the requested precision
+        self.height = self.height.astype(params.height_dtype, copy=False)
 
         # TRACKING VISITS TO EACH PATCH
-        self.patches_visited = defaultdict(set)
-        self.grid['visited'] = 0
+        # (which agents have visited which patch is tracked by the population; this is just the count)
+        self.visited[:] = 0
+
+        # EPISTEMIC MASS
+        # The mass above the significance threshold is kept as a running total (per region: here, the whole landscape),
+        # updated with the change in each patch's contribution whenever its height is set (see setSig)
+        self.region_rows = self.x_size
+        self.check_mass = params.check_mass
+        self.resetMass()
 
         # LANDSCAPE GLOBAL PROPERTIES
         # epistemic mass: total amount of epistemic value at start of simulation
         self.total_epistemic_mass = self.epistemicMass()
         # max height: value of tallest peak
-        self.max_height = np.max([self.getSig(x, y) for x in range(self.x_size) for y in range(self.y_size)])
+        self.max_height = np.max(self.height)
+
+    @property
+    def grid(self):
+        """
+        The landscape as a structured (x_size, y_size) array of patches with fields x, y, height, visited
+        (built on demand: changing it does not change the landscape)
+        """
+        grid = np.zeros((self.x_size,self.y_size),
+            dtype = [('x', np.int32),
+                     ('y', np.int32),
+                     ('height', self.height.dtype),
+                     ('visited', np.int32)])
+        grid['x'], grid['y'] = self.coordinates()
+        grid['height'] = self.height
+        grid['visited'] = self.visited
+        return grid
+
+    def coordinates(self):
+        """
+        OUTPUT: x and y coordinate of every patch, as two (x_size, y_size) arrays
+        """
+        return np.indices((self.x_size,self.y_size))
 
     def reportGrid(self):
         """
@@ -65,41 +111,48 @@ class Landscape():
         """
         # Annoyingly, the 3d_d3 library in the visualization script takes y to be height, so switch z and y
         # Also, make center of grid (0,0) by offsetting half of map size
-        return([{'x': point[0]-self.x_size/2, 'z': point[1]-self.y_size/2, 'y': point[2], 'visited': point[3]} for point in self.grid.flatten().tolist()])
+        x, y = self.coordinates()
+        return([{'x': point[0], 'z': point[1], 'y': point[2], 'visited': point[3]} for point in zip(
+            (x.ravel()-self.x_size/2).tolist(), (y.ravel()-self.y_size/2).tolist(), self.height.ravel().tolist(), self.visited.ravel().tolist())])
 
     def getSig(self,x,y):
         """
         INPUT: coordinate
         OUTPUT: epistemic value
         """
-        return self.grid[x,y]['height']
+        return self.height[x,y]
 
     def setSig(self,x,y,newSig):
         """
         INPUT: coordinates, and new height/epistemic significance for those coordinates
+        (coordinates and heights can also be arrays, in which case each patch should only appear once)
         """
-        self.grid[x,y]['height'] = newSig
+        old_mass = self.massContribution(self.height[x,y])
+        self.height[x,y] = newSig
+        self.addMass(x, self.massContribution(self.height[x,y]) - old_mass)
 
     def incrementHeight(self,x,y,amount):
-        self.grid[x,y]['height'] += amount
+        self.setSig(x, y, self.height[x,y] + amount)
 
-    def incrementVisit(self,patch,id):
+    def addVisitors(self,x_patch,y_patch):
         """
-        INPUT: coordinate x y, agent id
+        INPUT: coordinate arrays, with one entry for each agent visiting that patch for the first time
         """
-        # track that this patch has been exploited
-        self.patches_visited[patch].add(id)
-        self.grid[patch[0],patch[1]]['visited'] = len(self.patches_visited[patch])
+        # track that these patches have been exploited (a patch can appear more than once)
+        np.add.at(self.visited, (x_patch, y_patch), 1)
 
     def getVisited(self, x_patch, y_patch):
-        return self.grid[x_patch, y_patch]['visited']
+        return self.visited[x_patch, y_patch]
 
     def getPatch(self,x,y):
         """
         INPUT: coordinate
-        OUTPUT: reference to the patch object at coordinates (x,y)
+        OUTPUT: the patch at coordinates (x,y), as a record with fields x, y, height, visited
+        (a copy: changing it does not change the landscape)
         """
-        return self.grid[x,y]
+        patch = np.zeros((), dtype=[('x', np.int32), ('y', np.int32), ('height', self.height.dtype), ('visited', np.int32)])
+        patch['x'], patch['y'], patch['height'], patch['visited'] = x, y, self.height[x,y], self.visited[x,y]
+        return patch[()]
 
     def getMooreNeighborhood(self,x,y):
         """
@@ -107,35 +160,74 @@ class Landscape():
         INPUT: coordinate
         OUTPUT: Moore neigborhood for that patch
         """
-        for ind in range(8):
-            x_wrap = (x + self.mooreIndList[ind][0]) % self.x_size
-            y_wrap = (y + self.mooreIndList[ind][1]) % self.y_size
-            self.mooreArray[ind] = self.grid[x_wrap,y_wrap]
+        x_wrap = (x + self.mooreOffsets[:,0]) % self.x_size
+        y_wrap = (y + self.mooreOffsets[:,1]) % self.y_size
+        self.mooreArray['x'] = x_wrap
+        self.mooreArray['y'] = y_wrap
+        self.mooreArray['height'] = self.height[x_wrap,y_wrap]
+        self.mooreArray['visited'] = self.visited[x_wrap,y_wrap]
         return self.mooreArray
 
-    def addPerlin(self, noise, smoothing, octaves):
+    def addPerlin(self, noise, smoothing, octaves, rng):
         """
         Add Perlin noise
-        INPUT: noise (int): amplitude of noise; smoothing (int): randomness of noise (int in 1:4)
+        INPUT: noise (int): amplitude of noise; smoothing (int): randomness of noise (int in 1:4);
+        rng: numpy random Generator for the noise gradients
         """
-        pnf = PerlinNoiseFactory(2, octaves=octaves, tile=(self.x_size, self.y_size))
-        for x, y in [[x,y] for x in range(self.x_size) for y in range(self.x_size)]:
-            # adding noise/x at the end because otherwise 50% of landscape is below 0
-            self.incrementHeight(x, y, round(noise*pnf(x/smoothing, y/smoothing), 3))
+        pnf = PerlinNoiseFactory(2, octaves=octaves, tile=(self.x_size, self.y_size), rng=rng)
+        # build the whole noise field at once (same values as calling pnf on each patch in turn)
+        noise_field = pnf.noise_grid(np.arange(self.x_size)/smoothing, np.arange(self.y_size)/smoothing)
+        self.height += np.round(noise*noise_field, 3)
 
     def addGaussian(self,x_center,y_center,amplitude,sd):
         """
-        Generate some hills (from random normal distribution) at specified location
-        """
-        gaussian = multivariate_normal(mean=[x_center,y_center], cov=[[sd,0],[0,sd]])
-        for x, y in [[x,y] for x in range(self.x_size) for y in range(self.x_size)]:
-            # allow wrap around
-            height = max([gaussian.pdf([x,y]),gaussian.pdf([x-self.x_size,y]),gaussian.pdf([x,y-self.y_size]),gaussian.pdf([x-self.x_size,y-self.y_size])])
-            self.incrementHeight(x,y,round(amplitude*height,4))
+        Generate some hills (bivariate normal, variance sd in each direction) at specified location(s)
+        INPUT: x_center, y_center (float or array): hill centres, one entry per hill
+        """
+        x_center = np.atleast_1d(x_center)[:,None,None]
+        y_center = np.atleast_1d(y_center)[:,None,None]
+        x = np.arange(self.x_size)[None,:,None]
+        y = np.arange(self.y_size)[None,None,:]
+        # allow wrap around: the density is the largest of the images at (x,y), (x-x_size,y), (x,y-y_size), (x-x_size,y-y_size),
+        # i.e. the one with the smallest offset along each axis
+        dx = np.minimum(np.absolute(x-x_center), np.absolute(x-self.x_size-x_center))
+        dy = np.minimum(np.absolute(y-y_center), np.absolute(y-self.y_size-y_center))
+        # closed-form log density, evaluated the same way as scipy's multivariate_normal.logpdf
+        # so that heights are unchanged after rounding
+        whiten = np.sqrt(1/sd)
+        mahalanobis = np.square(dx*whiten) + np.square(dy*whiten)
+        log_density = -0.5*(2*np.log(2*np.pi) + 2*np.log(sd) + mahalanobis)
+        hills = np.round(amplitude*np.exp(log_density), 4)
+        for hill in hills:
+            self.height += hill
+
+    def massContribution(self, height):
+        # How much patches of these heights add to the epistemic mass
+        return np.where(height > self.sig_threshold, height, 0).astype(np.float64)
+
+    def resetMass(self):
+        # Add up the epistemic mass of each region from scratch
+        self.region_mass = self.fullRegionMass()
+
+    def fullRegionMass(self):
+        regions = self.height.reshape(-1, self.region_rows, self.y_size)
+        return np.array([np.sum(region[region > self.sig_threshold], dtype=np.float64) for region in regions])
+
+    def addMass(self, x, change):
+        # Add the change in some patches' contributions to the running total of their regions
+        region = np.ravel(x) // self.region_rows
+        self.region_mass += np.bincount(region, weights=np.ravel(change), minlength=len(self.region_mass))
+
+    def regionMass(self):
+        # Current epistemic mass remaining (above the significance threshold) in each region
+        if self.check_mass:
+            if not np.allclose(self.region_mass, self.fullRegionMass(), rtol=1e-9, atol=1e-9):
+                raise Exception("Running total of epistemic mass doesn't match the landscape")
+        return self.region_mass.copy()
 
     def epistemicMass(self):
         # Current epistemic mass remaining (above the significance threshold)
-        return(np.sum(self.grid['height'][self.grid['height']>self.sig_threshold]))
+        return self.regionMass()[0]
 
     def epistemicMassDiscovered(self):
         # How much of the original epistemic mass has been discovered by agents so far
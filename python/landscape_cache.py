@@ -0,0 +1,122 @@
+# On-disk cache of generated landscapes
+# A landscape is fully determined by its shape parameters plus a landscape seed,
+# so sweeps that reuse a small pool of seeds can load the height field instead of regenerating it.
+# Usage from the command line:
+#   python3 landscape_cache.py list [cache_dir]
+#   python3 landscape_cache.py prune [cache_dir] [max_mb]
+import os, re, sys, json, hashlib, tempfile
+import numpy as np
+
+# parameters that determine the generated height field
+KEY_PARAMS = ['map_size', 'hill_number', 'hill_width', 'noise', 'smoothing', 'octaves', 'landscape_seed']
+# bump this whenever landscape generation changes, so old entries are not reused
+CACHE_VERSION = 2
+# names of the files the cache writes (key + '.npy'): anything else in the directory is left alone
+ENTRY_NAME = re.compile(r'^[0-9a-f]{40}\.npy$')
+
+class LandscapeCache():
+    """
+    Directory of .npy height fields, named by a hash of the landscape parameters
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, params):
+        """
+        INPUT: params object
+        OUTPUT: hex digest identifying the landscape those params generate
+        """
+        key_data = {name: getattr(params, name) for name in KEY_PARAMS}
+        key_data['version'] = CACHE_VERSION
+        return hashlib.sha1(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def load(self, params):
+        """
+        OUTPUT: memory-mapped (read-only) height field, or None if not cached
+        """
+        path = self.path(self.key(params))
+        try:
+            heights = np.load(path, mmap_mode='r')
+            # mark as recently used, for eviction
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # (including if another worker has just removed it)
+            return None
+        return heights
+
+    def store(self, params, heights):
+        """
+        Save height field, then evict old entries if the cache is over its size limit
+        """
+        path = self.path(self.key(params))
+        # write to a temporary file first so parallel workers never read a half-written entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, heights)
+        os.replace(temp_path, path)
+        if self.max_bytes is not None:
+            self.prune(self.max_bytes)
+
+    def entries(self):
+        """
+        OUTPUT: list of (path, size in bytes, last used) for each cached landscape, least recently used first
+        """
+        entries = []
+        for file in os.listdir(self.directory):
+            if ENTRY_NAME.match(file):
+                path = os.path.join(self.directory, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # removed by another worker
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def prune(self, max_bytes):
+        """
+        Remove least recently used landscapes until the cache takes up at most max_bytes
+        OUTPUT: number of entries removed
+        """
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+if __name__ == "__main__":
+    try:
+        command = sys.argv[1]
+    except:
+        command = 'list'
+    try:
+        directory = sys.argv[2]
+    except:
+        directory = "../data/landscapes/"
+    cache = LandscapeCache(directory)
+
+    if command == 'list':
+        entries = cache.entries()
+        for path, size, _ in entries:
+            print('{}\t{:.1f} kB'.format(os.path.basename(path), size/1000))
+        print('{} landscapes, {:.1f} MB'.format(len(entries), sum(entry[1] for entry in entries)/1e6))
+    elif command == 'prune':
+        max_mb = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+        removed = cache.prune(max_mb*1e6)
+        print('removed {} landscapes'.format(removed))
+    else:
+        raise Exception("Command not recognised! Should be one of: list/prune")
@@ -7,6 +7,8 @@ from itertools import product
 import math
 import random
 
+import numpy as np
+
 
 def smoothstep(t):
     """Smooth curve with a zero derivative at 0 and 1, making it useful for
@@ -29,7 +31,7 @@ class PerlinNoiseFactory(object):
     the fly as necessary.
     """
 
-    def __init__(self, dimension, octaves, tile=(), unbias=False):
+    def __init__(self, dimension, octaves, tile=(), unbias=False, rng=random):
         """Create a new Perlin noise factory in the given number of dimensions,
         which should be an integer and at least 1.
 
@@ -46,11 +48,16 @@ class PerlinNoiseFactory(object):
         If ``unbias`` is true, the smoothstep function will be applied to the
         output before returning it, to counteract some of Perlin noise's
         significant bias towards the center of its output range.
+
+        ``rng`` is the source of randomness for the gradients: the ``random``
+        module by default, or a ``random.Random`` instance or
+        ``numpy.random.Generator`` for a reproducible pattern.
         """
         self.dimension = dimension
         self.octaves = octaves
         self.tile = tile + (0,) * dimension
         self.unbias = unbias
+        self.rng = rng
 
         # For n dimensions, the range of Perlin noise is +/-sqrt(n)/2; multiply
         # by this to scale to +/-1
@@ -65,17 +72,32 @@ class PerlinNoiseFactory(object):
         # 1 dimension is special, since the only unit vector is trivial;
         # instead, use a slope between -1 and 1
         if self.dimension == 1:
-            return (random.uniform(-1, 1),)
+            return (float(self.rng.uniform(-1, 1)),)
 
         # Generate a random point on the surface of the unit n-hypersphere;
         # this is the same as a random unit vector in n dimensions.  Thanks
         # to: http://mathworld.wolfram.com/SpherePointPicking.html
         # Pick n normal random variables with stddev 1
-        random_point = [random.gauss(0, 1) for _ in range(self.dimension)]
+        if isinstance(self.rng, np.random.Generator):
+            random_point = self.rng.standard_normal(self.dimension).tolist()
+        else:
+            random_point = [self.rng.gauss(0, 1) for _ in range(self.dimension)]
         # Then scale the result to a unit vector
         scale = sum(n * n for n in random_point) ** -0.5
         return tuple(coord * scale for coord in random_point)
 
+    def _generate_gradients(self, count):
+        # Same as calling _generate_gradient count times, but a numpy
+        # Generator can draw them all at once
+        if not isinstance(self.rng, np.random.Generator):
+            return [self._generate_gradient() for _ in range(count)]
+        if self.dimension == 1:
+            return [(u,) for u in self.rng.uniform(-1, 1, count).tolist()]
+        random_points = self.rng.standard_normal((count, self.dimension))
+        # (Python's ** rather than numpy's, which can differ in the last bit)
+        scales = [s ** -0.5 for s in (random_points * random_points).sum(axis=1).tolist()]
+        return [tuple(point) for point in (random_points * np.array(scales)[:, None]).tolist()]
+
     def get_plain_noise(self, *point):
         """Get plain noise for a single point, without taking into account
         either octaves or tiling.
@@ -161,3 +183,88 @@ class PerlinNoiseFactory(object):
             ret = r * 2 - 1
 
         return ret
+
+    def noise_grid(self, *axes):
+        """Get the value of this Perlin noise function over a whole grid at
+        once.  Takes one 1-D array of coordinates per dimension and returns an
+        array of shape ``(len(axes[0]), len(axes[1]), ...)``, indexed the same
+        way as ``numpy.meshgrid(*axes, indexing='ij')``.
+
+        Gradients are drawn in the same order as calling the factory on each
+        point of the grid in turn (last axis varying fastest), so for a given
+        seed the result is identical to the scalar path.
+        """
+        if len(axes) != self.dimension:
+            raise ValueError("Expected {} axes, got {}".format(
+                self.dimension, len(axes)))
+
+        # Every point of the grid, as a (points, dimension) array, in C order
+        mesh = np.meshgrid(*[np.asarray(axis, dtype=float) for axis in axes],
+                           indexing='ij')
+        shape = mesh[0].shape
+        points = np.stack([m.ravel() for m in mesh], axis=-1)
+
+        # Same coordinate transform as __call__, for every octave:
+        # octave_points has shape (points, octaves, dimension)
+        octave_points = np.empty((len(points), self.octaves, self.dimension))
+        for o in range(self.octaves):
+            o2 = 1 << o
+            for i in range(self.dimension):
+                coord = points[:, i] * o2
+                if self.tile[i]:
+                    coord = coord % (self.tile[i] * o2)
+                octave_points[:, o, i] = coord
+
+        # Lattice corners around each point, in the order that product() gives
+        # them in get_plain_noise: shape (points, octaves, 2**dimension, dimension)
+        mins = np.floor(octave_points)
+        offsets = np.array(list(product((0, 1), repeat=self.dimension)))
+        corners = mins[:, :, None, :] + offsets[None, None, :, :]
+
+        gradients = self._lattice_gradients(corners.reshape(-1, self.dimension))
+        gradients = gradients.reshape(corners.shape)
+
+        # Dot product of each gradient with the point's offset from that corner
+        dots = 0
+        for i in range(self.dimension):
+            dots = dots + gradients[..., i] * (octave_points[:, :, None, i] - corners[..., i])
+
+        # Collapse adjacent pairs, last dimension first, as get_plain_noise does
+        for dim in reversed(range(self.dimension)):
+            s = smoothstep(octave_points[:, :, dim] - mins[:, :, dim])[..., None]
+            dots = lerp(s, dots[..., 0::2], dots[..., 1::2])
+        plain = dots[..., 0] * self.scale_factor
+
+        ret = 0
+        for o in range(self.octaves):
+            ret = ret + plain[:, o] / (1 << o)
+        ret = ret / (2 - 2 ** (1 - self.octaves))
+
+        if self.unbias:
+            r = (ret + 1) / 2
+            for _ in range(int(self.octaves / 2 + 0.5)):
+                r = smoothstep(r)
+            ret = r * 2 - 1
+
+        return ret.reshape(shape)
+
+    def _lattice_gradients(self, corners):
+        """Look up (generating where needed) the gradient at each of the given
+        lattice points.  New gradients are generated in order of first
+        appearance, so the random stream is consumed exactly as it would be by
+        successive calls to get_plain_noise.
+        """
+        # Flatten each lattice point to a single integer key so np.unique
+        # works on a 1-D array
+        corners = corners.astype(np.int64)
+        low = corners.min(axis=0)
+        extent = corners.max(axis=0) - low + 1
+        keys = np.ravel_multi_index(tuple((corners - low).T), tuple(extent))
+        _, first_seen, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+        lattice = [tuple(grid_point) for grid_point in corners[first_seen].tolist()]
+        in_order = np.argsort(first_seen, kind='stable').tolist()
+        missing = [lattice[u] for u in in_order if lattice[u] not in self.gradient]
+        self.gradient.update(zip(missing, self._generate_gradients(len(missing))))
+        lattice_gradients = np.array([self.gradient[grid_point] for grid_point in lattice], dtype=float)
+        return lattice_gradients[inverse]
@@ -1,6 +1,7 @@
-import numpy as np, strategies
-from collections import defaultdict
-from scipy.stats import beta
+import numpy as np, strategies, kernels
+
+# Number of bits set in each possible byte, for counting visited patches (see uniquePatchesVisited) where numpy has no bitwise_count
+BITS_SET = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
 
 # Since the agent info is passed to the js script as a dict, but is handled as a structured array in the numpy matrices here,
 # this dict maps between the agent info keys and array indices
@@ -26,16 +27,52 @@ key_dict = {'id': 0,
     'failures': 19,
     'tolerance_start': 20}
 
+def betaCdf(x, a, b):
+    # Same as scipy.stats.beta.cdf(x, a, b) (including nan if a or b isn't positive), but without importing scipy.stats,
+    # which takes much longer to import than the rest of the simulation put together
+    from scipy.special import betainc
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    with np.errstate(invalid='ignore'):
+        return np.where((a > 0) & (b > 0), betainc(a, b, np.clip(x, 0, 1)), np.nan)
+
+def anticonformityTable(anticonformity, agent_number):
+    # How much agents devalue popular patches (see getAdjustedHeights), for every possible patch popularity
+    # INPUT: anticonformity: array of (distinct) anticonformity values
+    # OUTPUT: (len(anticonformity), agent_number+1) array: entry [i, n] is the adjustment for an agent with anticonformity[i]
+    # looking at a patch visited by n agents (0 if anticonformity is 0)
+    popularity = np.arange(agent_number+1)/agent_number
+    anticonf_beta = 10*anticonformity[:,None]
+    anticonf_alpha = 10-anticonf_beta
+    return np.where(anticonformity[:,None] == 0, 0, betaCdf(popularity[None,:], anticonf_alpha, anticonf_beta))
+
 # todo def setSocialLearningThreshold():
 
 class Population():
 
-    def __init__(self, landscape, params):
+    def __init__(self, landscape, params, rng=None):
         """
         Generate a population of agents and drop them in the desert
+        rng: numpy random Generator for this run (a fresh, unseeded one if not given)
         """
         self.landscape = landscape
+        self.rng = rng if rng is not None else np.random.default_rng()
         self.agent_number = params.agent_number
+        # 'batched': decide for all agents at once; 'reference': original one-agent-at-a-time loop
+        self.decide_mode = params.decide_mode
+        # 'sequential': agents sharing a patch deplete it in id order (batched by patch); 'reference': original loop giving the same results;
+        # 'simultaneous': agents sharing a patch all see its height at the start of the step
+        self.work_mode = params.work_mode
+        # only learn from agents within this distance (None: from anyone)
+        self.social_radius = params.social_radius
+        # 'numpy', or 'numba' for compiled versions of the loops in work and decide (same results: see kernels.py)
+        self.kernel_backend = kernels.backend(params.kernel_backend)
+        self.setKernels()
+        # The batched methods can also advance several replicate populations stacked into one array (see ensemble.py).
+        # For that they need, for each agent, the row at which its landscape starts in the (stacked) landscape arrays,
+        # and the index of the first agent in its replicate. For a single simulation both are always 0
+        self.landscape_row = np.zeros(self.agent_number, dtype=np.int64)
+        self.first_agent = np.zeros(self.agent_number, dtype=np.int64)
         self.agents = np.zeros((self.agent_number),dtype=[
                                                   ('id', 'i4'),
                                                   ('x','f4'),('y','f4'), #position on continuum
@@ -61,7 +98,7 @@ class Population():
         # assign index id
         self.agents['id'] = range(self.agent_number)
         # set heading to random
-        self.agents['heading'] = np.random.uniform(0,2*np.pi,self.agent_number)
+        self.agents['heading'] = self.rng.uniform(0,2*np.pi,self.agent_number)
         # have not visited any previous patch, so previous_height is 0
         self.agents['previous_height'] = 0
         # at the start, each agent has made 0 progress
@@ -71,25 +108,28 @@ class Population():
         # Have failed 0 times
         self.agents['failures'] = 0
 
-        # for tracking *unique* patches visited by each agent (uniqueness handled by type "set")
-        self.patches_visited = defaultdict(set)
+        # for tracking *unique* patches visited by each agent:
+        # one bit per (agent, patch), packed 8 patches to a byte. Bit for patch (x,y) is patch number x*y_size+y
+        patch_number = self.landscape.x_size*self.landscape.y_size
+        self.visited_bits = np.zeros((self.agent_number, (patch_number+7)//8), dtype=np.uint8)
 
         # Set the search strategies
         self.agents['velocity'] = strategies.set_velocity(params)
-        self.agents['threshold'] = strategies.set_thresholds(params)
-        self.agents['anticonformity'] = strategies.set_anticonformity(params)
-        self.agents['resilience'] = strategies.set_resilience(params)
-        self.agents['tolerance'] = strategies.set_tolerance(params)
+        self.agents['threshold'] = strategies.set_thresholds(params, self.rng)
+        self.agents['anticonformity'] = strategies.set_anticonformity(params, self.rng)
+        self.agents['resilience'] = strategies.set_resilience(params, self.rng)
+        self.agents['tolerance'] = strategies.set_tolerance(params, self.rng)
         self.agents['tolerance_start'] = np.copy(self.agents['tolerance'])
         self.agents['depletion_rate'] = strategies.set_depletion_rate(params)
+        self.setAdjustmentTable()
 
         #PLACE ALL AGENTS IN THE DESERT
         for agent in self.agents:
             # Iteratively check if the random placement is below the minimum significance for it to count as the desert
             low = False
             while not low:
-                x = np.random.uniform(0,self.landscape.x_size)
-                y = np.random.uniform(0,self.landscape.y_size)
+                x = self.rng.uniform(0,self.landscape.x_size)
+                y = self.rng.uniform(0,self.landscape.y_size)
                 starting_height = self.landscape.getSig(int(x),int(y))
                 if 0 <= starting_height < params.desert:
                     agent['x'] = x
@@ -98,6 +138,8 @@ class Population():
                     low = True
         self.agents['starting_x'] = self.agents['x_patch'] = np.floor(self.agents['x'])
         self.agents['starting_y'] = self.agents['y_patch'] = np.floor(self.agents['y'])
+        if self.social_radius is not None:
+            self.buildSpatialIndex()
 
     def trackAgents(self):
         """
@@ -112,15 +154,27 @@ class Population():
             'status': agent[key_dict['status']]} for agent in self.agents.tolist()]
         return(agents)
 
-    def reportSuccess(self):
-        # nothing calls this?!?!
+    def reportSuccess(self, which=slice(None)):
+        # which: the agents to report on, e.g. one replicate of a stacked population (default: all)
         keys = ['id', 'highest_point', 'threshold', 'consumed']
-        data = {x['id']: {key: x[key] for key in keys} for x in self.agents[keys]}
-        for id in self.patches_visited:
-            data[id]['patches_visited'] = len(self.patches_visited[id])
+        data = {x['id']: {key: x[key] for key in keys} for x in self.agents[which][keys]}
+        patches_visited = self.uniquePatchesVisited()[which]
+        for id in np.flatnonzero(patches_visited):
+            data[id]['patches_visited'] = patches_visited[id]
             # add more here: highest point, cumulative value, distance travelled, etc.
         return(data)
 
+    def allLost(self):
+        # Is every agent completely lost?
+        return np.all(self.agents['status'] == 3)
+
+    def uniquePatchesVisited(self):
+        # Number of different patches each agent has visited (not counting its starting patch, unless it came back to it)
+        # (counting the bits without unpacking them, which would take 8 times the memory of the bitmap)
+        if hasattr(np, 'bitwise_count'):
+            return np.bitwise_count(self.visited_bits).sum(axis=1, dtype=np.int64)
+        return BITS_SET[self.visited_bits].sum(axis=1, dtype=np.int64)
+
     def storePreviousPatch(self):
         # Update to reflect their previous patch
         self.agents['previous_x_patch'] = self.agents['x_patch']
@@ -131,21 +185,25 @@ class Population():
         # Reflect current position
         self.agents['x_patch'] = np.floor(self.agents['x'])
         self.agents['y_patch'] = np.floor(self.agents['y'])
-        self.agents['height'] = self.landscape.getSig(self.agents['x_patch'], self.agents['y_patch'])
+        self.agents['height'] = self.landscape.getSig(self.landscape_row + self.agents['x_patch'], self.agents['y_patch'])
 
         # Track if patch is new
         same_patch = np.logical_and(self.agents['x_patch'] == self.agents['previous_x_patch'], self.agents['y_patch'] == self.agents['previous_y_patch'])
-        # If so, add it to set of patches visited by agents
-        for i, same in enumerate(same_patch):
-            if not same:
-                patch = (self.agents[i]['x_patch'], self.agents[i]['y_patch'])
-                # track which patches this agent has visited
-                self.patches_visited[i].add(patch)
-                # track which agents have visited each patch
-                self.landscape.incrementVisit(patch, i)
+        # If so, mark it as visited by those agents
+        moved = np.flatnonzero(~same_patch)
+        x_patch = self.agents['x_patch'][moved]
+        y_patch = self.agents['y_patch'][moved]
+        patch = x_patch.astype(np.int64)*self.landscape.y_size + y_patch
+        patch_byte = patch >> 3
+        patch_bit = np.left_shift(1, patch & 7).astype(np.uint8)
+        first_visit = (self.visited_bits[moved, patch_byte] & patch_bit) == 0
+        # track which patches each agent has visited
+        self.visited_bits[moved, patch_byte] |= patch_bit
+        # track how many agents have visited each patch
+        self.landscape.addVisitors(self.landscape_row[moved][first_visit] + x_patch[first_visit], y_patch[first_visit])
 
         # Store popularity of current patch
-        self.agents['patch_popularity'] = self.landscape.getVisited(self.agents['x_patch'], self.agents['y_patch'])
+        self.agents['patch_popularity'] = self.landscape.getVisited(self.landscape_row + self.agents['x_patch'], self.agents['y_patch'])
 
         # Track if patch represents a new personal best
         self.agents['highest_point'] = np.where(
@@ -165,8 +223,72 @@ class Population():
         self.agents['y'] = np.round(self.agents['y'], 4) % self.landscape.y_size
         # After moving, update info from current patch
         self.updateNewPatch()
+        if self.social_radius is not None:
+            self.buildSpatialIndex()
+
+    def setKernels(self):
+        # Look up the compiled kernels once, rather than every timestep (each is compiled the first time it's called)
+        if self.kernel_backend == 'numba':
+            self.deplete_kernel = kernels.kernel(kernels.depleteSequential)
+            self.max_learnable_kernel = kernels.kernel(kernels.maxLearnable)
 
     def work(self):
+        if self.work_mode == 'sequential':
+            self.workBatched()
+        elif self.work_mode == 'simultaneous':
+            self.workBatched(simultaneous=True)
+        elif self.work_mode == 'reference':
+            self.workReference()
+        else:
+            raise Exception("work_mode not recognised (choose from: 'sequential', 'simultaneous', 'reference')")
+
+    def workBatched(self, simultaneous=False):
+        """
+        Deplete the patches agents are on, grouping agents by patch.
+        Sequential: same result as workReference, i.e. each agent sees the depletion by agents with lower ids on the same patch.
+        The n-th agents on each patch are handled together, so there are as many steps as agents on the most crowded patch
+        Simultaneous: every agent sees the patch height at the start of the step, and the patch loses the sum of their depletion rates
+        """
+        agents = self.agents
+        sig_threshold = self.landscape.sig_threshold
+        patch = (self.landscape_row + agents['x_patch'])*self.landscape.y_size + agents['y_patch']
+        patches, which = np.unique(patch, return_inverse=True)
+        x_patch = patches // self.landscape.y_size
+        y_patch = patches % self.landscape.y_size
+
+        if simultaneous:
+            height = self.landscape.getSig(x_patch, y_patch)
+            total_depletion = np.bincount(which, weights=agents['depletion_rate'], minlength=len(patches))
+            new_height = np.where(height > sig_threshold, np.maximum(height - total_depletion, sig_threshold), height)
+            self.landscape.setSig(x_patch, y_patch, new_height)
+            agents['consumed'] += height[which]
+        elif self.kernel_backend == 'numba':
+            # one agent at a time, in id order, on a copy of the heights of the patches they're on
+            height = self.landscape.getSig(x_patch, y_patch)
+            self.deplete_kernel(height, which, agents['depletion_rate'] + sig_threshold,
+                agents['depletion_rate'], height.dtype.type(sig_threshold), agents['consumed'])
+            self.landscape.setSig(x_patch, y_patch, height)
+        else:
+            # rank of each agent among those on the same patch, in id order
+            order = np.argsort(which, kind='stable')
+            counts = np.bincount(which)
+            rank = np.empty(len(agents), dtype=int)
+            rank[order] = np.arange(len(agents)) - np.repeat(np.cumsum(counts) - counts, counts)
+            # agents of equal rank are all on different patches, so can be handled at once
+            by_rank = np.argsort(rank, kind='stable')
+            rank_counts = np.bincount(rank)
+            for wave in np.split(by_rank, np.cumsum(rank_counts)[:-1]):
+                x = x_patch[which[wave]]
+                y = y_patch[which[wave]]
+                height = self.landscape.getSig(x, y)
+                depletion_rate = agents['depletion_rate'][wave]
+                new_height = np.where(height >= depletion_rate + sig_threshold, height - depletion_rate,
+                    np.where(height > sig_threshold, sig_threshold, height))
+                self.landscape.setSig(x, y, new_height)
+                agents['consumed'][wave] += height
+
+    def workReference(self):
+        # One agent at a time: agents with higher indexes see the depletion by those with lower indexes
         for agent in self.agents:
             # get the height each time, otherwise agents with higher indexes will have out-of-date info
             height = self.landscape.getSig(agent['x_patch'], agent['y_patch'])
@@ -202,6 +324,9 @@ class Population():
         ## Or those who aren't on a patch of any significance
         below_significance = self.agents['height'] <= self.landscape.sig_threshold
         dont_follow = np.logical_or(too_close, below_significance)
+        ## Or those beyond the social radius
+        if self.social_radius is not None:
+            dont_follow = np.logical_or(dont_follow, self.beyondSocialRadius(i, np.arange(len(self.agents))))
 
         # Calculate how much higher (than the focal agent) others were at the end of the previous time step,
         # Adjusting the estimation of their heights according to focal agent's biases,
@@ -212,6 +337,12 @@ class Population():
         inclines = heightDeltas / distances
         return(inclines)
 
+    def setAdjustmentTable(self):
+        # Anticonformity adjustments for every distinct anticonformity value in the population and every patch popularity
+        # (anticonformity is fixed for the whole run, so this is done once); adjustment_row: each agent's row in the table
+        anticonformity, self.adjustment_row = np.unique(self.agents['anticonformity'], return_inverse=True)
+        self.adjustment_table = anticonformityTable(anticonformity, self.agent_number)
+
     def getAdjustedHeights(self, agent, dont_follow):
         popularity = self.agents['patch_popularity']/len(self.agents)
         # How anticonformist is this agent?
@@ -220,11 +351,11 @@ class Population():
         # assuming alpha + beta = 10 for beta.cdf
 
         if anticonformity == 0:
-            adjustment == 0
+            adjustment = 0
         else:
             anticonf_beta = 10*anticonformity
             anticonf_alpha = 10-anticonf_beta
-            adjustment = beta.cdf(popularity, anticonf_alpha, anticonf_beta)
+            adjustment = betaCdf(popularity, anticonf_alpha, anticonf_beta)
         # Difference in height from focal agent
         others_heights = self.agents['height']*(1-adjustment)
         height_deltas = others_heights - self.landscape.getSig(agent['x_patch'],agent['y_patch'])
@@ -248,6 +379,15 @@ class Population():
 
     def decide(self, total_time):
         # Decide whether to keep going/look around/follow someone
+        if self.decide_mode == 'batched':
+            self.decideBatched(total_time)
+        elif self.decide_mode == 'reference':
+            self.decideReference(total_time)
+        else:
+            raise Exception("decide_mode not recognised (choose from: 'batched', 'reference')")
+
+    def decideReference(self, total_time):
+        # One agent at a time (slow, but easy to follow: decideBatched must give the same results)
         for i, agent in enumerate(self.agents):
             # If too far downhill, make a decision about learning strategy
             intolerable_decrease = self.goneTooFarDown(i)
@@ -269,6 +409,194 @@ class Population():
                 # Keep going
                 agent['status'] = 0
 
+    def decideBatched(self, total_time):
+        # Same decisions as decideReference, but evaluated for all agents at once.
+        # Random draws are still made agent by agent, in id order, so that both modes use the random stream identically
+        agents = self.agents
+        current_heights = self.landscape.getSig(self.landscape_row + agents['x_patch'], agents['y_patch'])
+
+        # Who has gone too far downhill? (see goneTooFarDown)
+        failing = current_heights < agents['previous_height'] - agents['tolerance']
+        agents['failures'][failing] += 1
+        # Everyone else keeps going
+        agents['status'][~failing] = 0
+        rows = np.flatnonzero(failing)
+        if len(rows) == 0:
+            return
+
+        # reduce the failing agents' thresholds
+        agents['threshold'][rows] = np.maximum(0, agents['threshold'][rows] - (1-agents['resilience'][rows])*(2/total_time))
+
+        # Find out how much the failing agents could potentially learn from others
+        max_learnable, tie_counts, tie_starts, tie_candidates = self.checkMaxLearnableBatched(rows, current_heights)
+        social = np.logical_and(max_learnable > agents['threshold'][rows], tie_counts > 0)
+
+        # Moore neighborhoods of those who will explore locally (see exploreLocalArea)
+        moore_offsets = self.landscape.mooreOffsets
+        moore_x = (agents['x_patch'][rows,None] + moore_offsets[:,0]) % self.landscape.x_size
+        moore_y = (agents['y_patch'][rows,None] + moore_offsets[:,1]) % self.landscape.y_size
+        # (neighborhood heights are compared at the precision of getMooreNeighborhood)
+        moore_heights = self.landscape.getSig(self.landscape_row[rows,None] + moore_x, moore_y).astype(np.float32)
+        geq_moores = moore_heights - current_heights[rows,None] >= 0
+        geq_counts = geq_moores.sum(axis=1)
+
+        # Random draws, in agent order (each from the generator of the agent's own run)
+        best_candidates = np.zeros(len(rows), dtype=int)
+        chosen_moores = np.zeros(len(rows), dtype=int)
+        random_headings = np.zeros(len(rows))
+        for k in range(len(rows)):
+            rng = self.agentRng(rows[k])
+            if tie_counts[k] > 0:
+                # Find the best candidate to learn from (choose randomly if tie)
+                best_candidates[k] = tie_candidates[tie_starts[k] + rng.choice(tie_counts[k])]
+            if not social[k]:
+                if geq_counts[k] > 0:
+                    # select a random higher neighboring patch to check
+                    chosen_moores[k] = np.flatnonzero(geq_moores[k])[rng.choice(geq_counts[k])]
+                else:
+                    # pick a completely random direction
+                    random_headings[k] = rng.uniform(0,2*np.pi)
+
+        # Follow the best candidate
+        social_rows = rows[social]
+        best = best_candidates[social]
+        self.setHeadings(social_rows, agents['x_patch'][best], agents['y_patch'][best])
+        agents['status'][social_rows] = 1 # social learning
+
+        # Explore locally
+        local = np.logical_and(~social, geq_counts > 0)
+        local_moores = chosen_moores[local]
+        self.setHeadings(rows[local], moore_x[local, local_moores], moore_y[local, local_moores])
+        agents['status'][rows[local]] = 4 # exploring-local
+
+        lost = np.logical_and(~social, geq_counts == 0)
+        agents['heading'][rows[lost]] = random_headings[lost]
+        agents['status'][rows[lost]] = 3 # completely lost
+
+    def agentRng(self, i):
+        # Random generator to use for agent i's decisions
+        return self.rng
+
+    def checkMaxLearnableBatched(self, rows, current_heights, chunk_size=512):
+        """
+        Vectorized checkMaxLearnable for the agents in rows
+        OUTPUT: max_learnable (-9999 if nobody to learn from) for each row,
+        plus the tied best candidates, as counts and start positions in a flat array of candidate indices
+        """
+        max_learnable = np.full(len(rows), -9999.0)
+        tie_counts = np.zeros(len(rows), dtype=int)
+        tie_candidates = []
+        if self.agent_number > 1 and self.social_radius is None and self.kernel_backend == 'numba':
+            # one focal agent at a time (see kernels.py)
+            agents = self.agents
+            max_learnable, tie_counts, candidates = self.max_learnable_kernel(rows, self.first_agent, self.agent_number,
+                agents['x'], agents['y'], agents['height'], agents['patch_popularity'], agents['height'] <= self.landscape.sig_threshold,
+                self.adjustment_table, self.adjustment_row, current_heights.astype(np.float64),
+                np.float32(self.landscape.x_size), np.float32(self.landscape.y_size))
+            tie_candidates.append(candidates)
+        elif self.agent_number > 1 and self.social_radius is None:
+            # everyone (in the same replicate) is a candidate:
+            # work through the rows in chunks to bound the size of the (rows x agents) matrices
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start+chunk_size]
+                everyone = self.first_agent[chunk,None] + np.arange(self.agent_number)[None,:]
+                inclines = self.checkOthersValuesBatched(chunk[:,None], everyone, current_heights)
+                inclines = np.where(np.isnan(inclines), -np.inf, inclines)
+                chunk_max = inclines.max(axis=1)
+                has_candidate = chunk_max > -np.inf
+                max_learnable[start:start+chunk_size] = np.where(has_candidate, chunk_max, -9999)
+                tie_rows, tie_cols = np.nonzero(np.logical_and(inclines == chunk_max[:,None], has_candidate[:,None]))
+                tie_counts[start:start+chunk_size] = np.bincount(tie_rows, minlength=len(chunk))
+                tie_candidates.append(self.first_agent[chunk][tie_rows] + tie_cols)
+        elif self.agent_number > 1:
+            # only agents in nearby cells are candidates: look them up in the spatial index
+            pair_rows, pair_candidates = self.nearbyAgents(rows)
+            inclines = self.checkOthersValuesBatched(rows[pair_rows], pair_candidates, current_heights)
+            inclines = np.where(np.isnan(inclines), -np.inf, inclines)
+            rows_max = np.full(len(rows), -np.inf)
+            np.maximum.at(rows_max, pair_rows, inclines)
+            has_candidate = rows_max > -np.inf
+            max_learnable = np.where(has_candidate, rows_max, -9999)
+            ties = np.logical_and(inclines == rows_max[pair_rows], has_candidate[pair_rows])
+            tie_counts = np.bincount(pair_rows[ties], minlength=len(rows))
+            tie_candidates.append(pair_candidates[ties])
+        tie_candidates = np.concatenate(tie_candidates) if tie_candidates else np.zeros(0, dtype=int)
+        tie_starts = np.cumsum(tie_counts) - tie_counts
+        return max_learnable, tie_counts, tie_starts, tie_candidates
+
+    def checkOthersValuesBatched(self, focal, others, current_heights):
+        """
+        Vectorized checkOthersValues: inclines from each focal agent to the corresponding other agent
+        INPUT: focal, others: broadcastable arrays of agent indices
+        (e.g. a column of focal agents and a row of all agents, or two flat arrays of pairs)
+        """
+        agents = self.agents
+        # Toroidal distances
+        distX1 = agents['x'][others] - agents['x'][focal]
+        distX2 = self.landscape.x_size - distX1 #WRAPPED DISTANCE
+        distY1 = agents['y'][others] - agents['y'][focal]
+        distY2 = self.landscape.y_size - distY1 #WRAPPED DISTANCE
+        distances = np.sqrt(np.minimum(distX2,distX1)**2 + np.minimum(distY2,distY1)**2)
+
+        # Rule out those on the same patch or not on a patch of any significance (or too far away)
+        too_close = np.logical_and(agents['x'][others] == agents['x'][focal], agents['y'][others] == agents['y'][focal])
+        below_significance = agents['height'][others] <= self.landscape.sig_threshold
+        dont_follow = np.logical_or(too_close, below_significance)
+        if self.social_radius is not None:
+            dont_follow = np.logical_or(dont_follow, self.beyondSocialRadius(focal, others))
+
+        # Adjust others' heights according to each focal agent's anticonformity (see getAdjustedHeights),
+        # looked up by the focal agent's anticonformity and the other's patch popularity (see setAdjustmentTable)
+        adjustment = self.adjustment_table[self.adjustment_row[focal], agents['patch_popularity'][others]]
+        others_heights = agents['height'][others]*(1-adjustment)
+        height_deltas = others_heights - current_heights[focal]
+        heights_deltas_filtered = np.where(dont_follow, np.nan, height_deltas)
+
+        # Calculate value as change in height / distance
+        inclines = heights_deltas_filtered / distances
+        return(inclines)
+
+    def beyondSocialRadius(self, focal, others):
+        # Is the (shortest, toroidal) distance between the agents greater than social_radius?
+        distX = np.absolute(self.agents['x'][others] - self.agents['x'][focal])
+        distX = np.minimum(distX, self.landscape.x_size - distX)
+        distY = np.absolute(self.agents['y'][others] - self.agents['y'][focal])
+        distY = np.minimum(distY, self.landscape.y_size - distY)
+        return np.sqrt(distX**2 + distY**2) > self.social_radius
+
+    def buildSpatialIndex(self):
+        """
+        Bucket agents by the patch they are on (agents sorted by patch, plus where each patch's agents start),
+        so that nearbyAgents only has to look at the patches around a focal agent
+        """
+        patch = (self.landscape_row + self.agents['x_patch'])*self.landscape.y_size + self.agents['y_patch']
+        self.index_order = np.argsort(patch, kind='stable')
+        patch_counts = np.bincount(patch, minlength=self.landscape.height.size)
+        self.index_start = np.concatenate([[0], np.cumsum(patch_counts)])
+
+    def nearbyAgents(self, rows):
+        """
+        Use the spatial index to find all agents on patches that could be within social_radius of each agent in rows
+        OUTPUT: flat arrays of (position in rows, candidate agent index) pairs, sorted by row and then candidate
+        """
+        reach = int(np.ceil(self.social_radius))
+        x_offsets = np.arange(-reach, reach+1) if 2*reach+1 < self.landscape.x_size else np.arange(self.landscape.x_size)
+        y_offsets = np.arange(-reach, reach+1) if 2*reach+1 < self.landscape.y_size else np.arange(self.landscape.y_size)
+        x_cells = self.landscape_row[rows,None] + (self.agents['x_patch'][rows,None] + x_offsets[None,:]) % self.landscape.x_size
+        y_cells = (self.agents['y_patch'][rows,None] + y_offsets[None,:]) % self.landscape.y_size
+        cells = (x_cells[:,:,None]*self.landscape.y_size + y_cells[:,None,:]).reshape(len(rows), -1)
+
+        # expand each (row, cell) into the agents in that cell
+        cell_starts = self.index_start[cells].ravel()
+        cell_counts = self.index_start[cells+1].ravel() - cell_starts
+        cell_of_pair = np.repeat(np.arange(len(cell_counts)), cell_counts)
+        within_cell = np.arange(len(cell_of_pair)) - np.repeat(np.cumsum(cell_counts) - cell_counts, cell_counts)
+        pair_candidates = self.index_order[cell_starts[cell_of_pair] + within_cell]
+        pair_rows = cell_of_pair // cells.shape[1]
+
+        order = np.lexsort((pair_candidates, pair_rows))
+        return pair_rows[order], pair_candidates[order]
+
     def checkMaxLearnable(self, i):
         # Find out out much agent could potentially learn from others
         # (which means there must be at least one other agent)
@@ -282,7 +610,7 @@ class Population():
             else:
                 max_learnable = np.nanmax(inclines)
                 # Find the best candidate to learn from (choose randomly if tie)
-                best_candidate = self.agents[np.random.choice(np.flatnonzero(inclines == np.nanmax(inclines)))]
+                best_candidate = self.agents[self.rng.choice(np.flatnonzero(inclines == np.nanmax(inclines)))]
         else:
             max_learnable = -9999
             best_candidate = None
@@ -301,15 +629,37 @@ class Population():
 
         if len(geqMoores) > 0:
             # If any neighboring patch is higher, select a random higher patch to check
-            chosenPatch = np.random.choice(geqMoores)
+            chosenPatch = self.rng.choice(geqMoores)
             self.setHeading(i,chosenPatch['x'],chosenPatch['y'])
             agent['status'] = 4 # exploring-local
         else:
             # If no patches are higher, pick a completely random direction
-            agent['heading'] = np.random.uniform(0,2*np.pi)
+            agent['heading'] = self.rng.uniform(0,2*np.pi)
             agent['status'] = 3 # completely lost
 
 
+    def setHeadings(self,rows,xTarg,yTarg):
+        """
+        Vectorized setHeading: sets each agent in rows heading towards its target position
+        """
+        agents = self.agents
+        cos = self.wrappedOffset(xTarg, agents['x_patch'][rows], self.landscape.x_size)
+        sin = self.wrappedOffset(yTarg, agents['y_patch'][rows], self.landscape.y_size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tan = sin / cos
+        #choose the heading in the correct quadrant (modulo makes the angle > 0)
+        heading = np.where(cos > 0, np.arctan(tan) % (2*np.pi), (np.pi+np.arctan(tan)) % (2*np.pi))
+        #handle division by zero
+        heading = np.where(cos == 0, np.where(sin > 0, np.pi/2, 3*np.pi/2), heading)
+        agents['heading'][rows] = heading
+
+    def wrappedOffset(self, target, position, size):
+        # Offset from position to target along one axis, taking the shortest route around the torus
+        # (same tie-breaking as setHeading: the first of target-size, target, target+size)
+        target = np.asarray(target, dtype=np.int64)
+        offsets = np.stack([target-size, target, target+size]) - position
+        return np.take_along_axis(offsets, np.argmin(np.absolute(offsets), axis=0)[None,:], axis=0)[0]
+
     def setHeading(self,i,xTarg,yTarg):
         """
         Sets agent's heading towards the target position
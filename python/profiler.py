@@ -0,0 +1,91 @@
+# Optional record of where a run's time goes (set GlobalParams.profile = True; see Simulation.run)
+# Each step of a run (updateData, move, decide, work) and the methods they use are timed by replacing them,
+# on this run's own landscape/population objects, with timed versions: so when profiling is off, nothing is timed at all.
+# Also counts what agents decided each timestep (e.g. how many failed the tolerance test)
+
+import time
+import numpy as np
+
+# Methods to time, for each object of a run
+PHASES = {'simulation': ['updateData'], 'population': ['move', 'decide', 'work']}
+SUBSTEPS = {
+    'population': ['storePreviousPatch', 'updateNewPatch', 'buildSpatialIndex',
+        'decideBatched', 'checkMaxLearnableBatched', 'checkOthersValuesBatched', 'setHeadings',
+        'decideReference', 'goneTooFarDown', 'checkMaxLearnable', 'checkOthersValues', 'getAdjustedHeights', 'exploreLocalArea',
+        'workBatched', 'workReference'],
+    'landscape': ['epistemicMass'],
+}
+# What agents decided in a timestep, from their status after deciding
+# (all the agents that failed the tolerance test get a non-zero status: see Population.decide)
+DECISIONS = {'failed_tolerance': lambda status: status != 0, 'social_learning': lambda status: status == 1,
+    'exploring_local': lambda status: status == 4, 'lost': lambda status: status == 3}
+
+class Profiler():
+    """
+    Time spent in, and calls to, each step and sub-step of a run, plus counts of agents' decisions per timestep
+    """
+    def __init__(self, simulation):
+        self.calls = {}
+        self.seconds = {}
+        self.slowest = {}
+        self.kinds = {}
+        self.counts = {name: [] for name in DECISIONS}
+        objects = {'simulation': simulation, 'population': simulation.population, 'landscape': simulation.landscape}
+        for kind, methods in [('phase', PHASES), ('substep', SUBSTEPS)]:
+            for object_name, names in methods.items():
+                for name in names:
+                    self.instrument(objects[object_name], name, kind)
+
+    def instrument(self, obj, name, kind):
+        # Replace obj.name (for this object only) with a version that records its calls
+        method = getattr(obj, name, None)
+        if method is None:
+            return
+        self.calls[name] = 0
+        self.seconds[name] = 0
+        self.slowest[name] = 0
+        self.kinds[name] = kind
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                self.calls[name] += 1
+                self.seconds[name] += seconds
+                if seconds > self.slowest[name]:
+                    self.slowest[name] = seconds
+        setattr(obj, name, timed)
+
+    def countDecisions(self, population):
+        # Call once per timestep, after the agents have decided
+        status = population.agents['status']
+        for name, decided in DECISIONS.items():
+            self.counts[name].append(int(np.count_nonzero(decided(status))))
+
+    def rows(self, replicates=1):
+        """
+        INPUT: number of replicates run together (in an ensemble: times and counts are for all of them at once)
+        OUTPUT: one row per step/sub-step that was called (times in ms: total, mean and max per call)
+        and per kind of decision (number of agents: total, mean and max per timestep)
+        """
+        rows = {}
+        for name in self.calls:
+            if self.calls[name] > 0:
+                rows[name] = {'name': name, 'kind': self.kinds[name], 'calls': self.calls[name], 'total': 1000*self.seconds[name],
+                    'mean': 1000*self.seconds[name]/self.calls[name], 'max': 1000*self.slowest[name], 'replicates': replicates}
+        for name, counts in self.counts.items():
+            rows[name] = {'name': name, 'kind': 'count', 'calls': len(counts), 'total': sum(counts),
+                'mean': np.mean(counts) if len(counts) > 0 else 0, 'max': max(counts, default=0), 'replicates': replicates}
+        return(rows)
+
+    def summary(self):
+        # Short text version of rows(), slowest first
+        rows = sorted(self.rows().values(), key=lambda row: (row['kind'] == 'count', -row['total']))
+        lines = []
+        for row in rows:
+            if row['kind'] == 'count':
+                lines.append('{name}: {total} agents ({mean:.1f} per timestep, max {max})'.format(**row))
+            else:
+                lines.append('{name} ({kind}): {total:.1f}ms in {calls} calls ({mean:.3f}ms per call, max {max:.3f}ms)'.format(**row))
+        return('\n'.join(lines))
@@ -1,13 +1,18 @@
-import sys, os, re, itertools, concurrent.futures, json, random
-from simulation import Simulation, GlobalParams, singleRun
-import files
-from tqdm import tqdm
+import sys, os, re, itertools, concurrent.futures, json, time
+import numpy as np
+from simulation import Simulation, GlobalParams
+import files, sweep
 
 if __name__ == "__main__":
 
+    # '--resume' (anywhere in the args) picks up an interrupted sweep where it left off, e.g. `python3 run_simulations.py 7 basic --resume`
+    # (only runs that haven't finished are run; the data files are kept)
+    resume = '--resume' in sys.argv
+    args = [arg for arg in sys.argv if arg != '--resume']
+
     try:
         # when called from the node app, the first arg is 'browser'
-        sim_type = sys.argv[1]
+        sim_type = args[1]
     except:
         sim_type = 'test'
 
@@ -17,12 +22,12 @@ if __name__ == "__main__":
         # 'agents': all agents (no time steps)
         # 'basic': just group-level info at end of run (report neither timesteps nor individual agents)
         # (both all times & all agents seems overkill for now...)
-        detail = sys.argv[2]
+        detail = args[2]
     except:
         detail = 'basic'
     # Set up sim runs depending whether this is called from Node app or with python3 at command line
     if sim_type == "browser":
-        browser_params = json.loads(sys.argv[3])
+        browser_params = json.loads(args[3])
         simulation = Simulation(GlobalParams, browser_params, sim_type, detail)
         simulation.run()
     else:
@@ -79,54 +84,180 @@ if __name__ == "__main__":
          # 'depletion_rate': [0.1, 0.2],
          # 'noise': [3],
          # 'smoothing': [3]
+         # Reuse a small pool of landscapes (set GlobalParams.landscape_cache to cache them on disk)
+         # 'landscape_seed': list(range(10)),
         }
 
-        # Set up filenames for storing data and sim parameters
-        file_id = files.fileSuffix(sim_type)
+        # How to save the data: 'npz' (chunks of numpy arrays, see files.load_results; `python3 files.py csv ../data/data<id>` converts them to csv)
+        # or 'csv'
+        output_format = 'npz'
 
-        # to store the invariant parameters
+        # Set up filenames for storing data, sim parameters, and sweep progress
+        file_id = files.fileSuffix(sim_type, resume)
         param_file = "../data/param{}.json".format(file_id)
-        with open(param_file, "w") as file_out:
-            # store all (global and simulation-specific) parameters
-            all_params = vars(GlobalParams)
-            all_params = {x: all_params[x] for x in all_params if '__' not in x}
-            for param in sim_parameters:
-                all_params[param] = sim_parameters[param]
-            print(all_params)
-            json.dump(all_params, file_out, indent=4)
-
-        # to store group-level data and the params that vary across sims
-        data_file = "../data/data{}.csv".format(file_id)
-        print('will save to {}'.format(data_file))
+        # the manifest lists every task of the sweep (sim numbers, seeds, params); the done file lists the sims that have finished
+        manifest_file = "../data/manifest{}.json".format(file_id)
+        done_file = "../data/done{}.txt".format(file_id)
+
+        if resume:
+            manifest = files.read_manifest(manifest_file)
+            if manifest['detail'] != detail:
+                raise Exception("Sweep {} was run with detail '{}'".format(file_id, manifest['detail']))
+            output_format = manifest['output_format']
+            adaptive = manifest.get('adaptive')
+
+        data_stem = "../data/data{}".format(file_id)
+        agents_stem = "../data/agents{}".format(file_id)
+        extension = '.csv' if output_format == 'csv' else ''
+        data_file = data_stem + extension
+        agents_file = agents_stem + extension if detail == 'agents' else None
         data_file_headers = files.get_data_headers(sim_parameters)
-        with open(data_file, "w") as f:
-            f.write(data_file_headers)
+        agent_columns_to_get = ['id', 'highest_point', 'threshold', 'consumed', 'patches_visited', 'sim', 'seed']
+        agent_file_headers = files.get_data_headers(sim_parameters, agent_columns_to_get)
+        # with GlobalParams.profile, where each run's time went is also saved (see profiler.py)
+        profile_stem = "../data/profile{}".format(file_id)
+        profile_file = profile_stem + extension if GlobalParams.profile else None
+        profile_columns_to_get = ['name', 'kind', 'calls', 'total', 'mean', 'max', 'replicates', 'sim', 'seed']
+        profile_file_headers = files.get_data_headers(sim_parameters, profile_columns_to_get)
 
-        # to store agent-level data and the params that vary across sims
-        if detail == 'agents':
-            agents_file = "../data/agents{}.csv".format(file_id)
-            agent_columns_to_get = ['id', 'highest_point', 'threshold', 'consumed', 'patches_visited', 'sim']
-            agent_file_headers = files.get_data_headers(sim_parameters, agent_columns_to_get)
-            with open(agents_file, "w") as f:
-                f.write(agent_file_headers)
+        if resume:
+            done = files.read_done(done_file)
+            # a task is only done if all its runs are (otherwise it is done again, from the start)
+            done = {sim for task in manifest['tasks'] if set(task['sims']) <= done for sim in task['sims']}
+            # drop any rows saved by runs that didn't finish, as they will be run again
+            files.drop_unfinished(data_file, done)
+            if agents_file is not None:
+                files.drop_unfinished(agents_file, done)
+            if profile_file is not None:
+                files.drop_unfinished(profile_file, done)
+            print('resuming {}: {} of {} runs already done'.format(data_file, len(done), sum(len(task['sims']) for task in manifest['tasks'])))
         else:
-            agents_file = None
-
-        # Create list of tasks to run in parallel
-        keys = sim_parameters.keys()
-        values = (sim_parameters[key] for key in keys)
-        # get combinations of above keys (params) and values (possible settings of params)
-        run_list = [dict(zip(keys, combination)) for combination in itertools.product(*values)]
-        # how many runs in total
-        if sim_type == 'test':
-            R = 1
-        else:
-            # try to get 200 runs per cell
-            R = 200*len(run_list)
-        # OR just set number of runs manually, e.g. for testing, by uncommenting and updating the following
-        # R = 1
-        # Sample randomly from the list of runs
-        tasks = [(GlobalParams, random.choice(run_list), i, detail, data_file, agents_file) for i in range(R)]
-
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            results_ = list(tqdm(executor.map(singleRun, tasks), total=R)) # list() needed for tqdm to work for some reason
+            # Every run gets its own random number generator, seeded from this root seed and the run's sim number,
+            # so any run can be repeated exactly (its seed is saved with its data). None = pick a new root seed
+            root_seed = None
+            if root_seed is None:
+                root_seed = np.random.SeedSequence().entropy
+
+            # to store the invariant parameters
+            with open(param_file, "w") as file_out:
+                # store all (global and simulation-specific) parameters
+                all_params = vars(GlobalParams)
+                all_params = {x: all_params[x] for x in all_params if '__' not in x}
+                for param in sim_parameters:
+                    all_params[param] = sim_parameters[param]
+                all_params['root_seed'] = root_seed
+                print(all_params)
+                json.dump(all_params, file_out, indent=4)
+
+            # to store group-level data and the params that vary across sims
+            print('will save to {}'.format(data_file))
+            # (clear out anything saved by an earlier sweep with the same id)
+            for chunk_file in files.chunk_files(data_stem) + files.chunk_files(agents_stem) + files.chunk_files(profile_stem):
+                os.remove(chunk_file)
+            if output_format == 'csv':
+                with open(data_file, "w") as f:
+                    f.write(data_file_headers)
+
+            # to store agent-level data and the params that vary across sims
+            if detail == 'agents' and output_format == 'csv':
+                with open(agents_file, "w") as f:
+                    f.write(agent_file_headers)
+            if profile_file is not None and output_format == 'csv':
+                with open(profile_file, "w") as f:
+                    f.write(profile_file_headers)
+
+            # Create list of tasks to run in parallel
+            keys = sim_parameters.keys()
+            values = (sim_parameters[key] for key in keys)
+            # get combinations of above keys (params) and values (possible settings of params)
+            run_list = [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+            # how many runs in total
+            if sim_type == 'test':
+                R = 1
+            else:
+                # try to get 200 runs per cell
+                R = 200*len(run_list)
+            # OR just set number of runs manually, e.g. for testing, by uncommenting and updating the following
+            # R = 1
+            # Runs with the same parameters can be done together as one ensemble (see ensemble.py),
+            # which is faster for small maps. 1 = each run is done on its own
+            ensemble_size = 1
+            # OR run an adaptive sweep: rather than R runs in total, each combination of params gets runs in rounds
+            # (min_runs, then round_size more at a time) until the confidence interval of the mean outcome
+            # (at the last timestep) is narrower than ci_width, or it has had max_runs runs. None = R runs, as above
+            adaptive = None
+            # adaptive = {'outcome': 'mass', 'confidence': 0.95, 'ci_width': 0.02, 'min_runs': 20, 'max_runs': 200, 'round_size': 20}
+            # One seed per run: the integer seed of run i is derived from child i of the root seed sequence
+            seeds = [int(child.generate_state(1, np.uint64)[0]) for child in np.random.SeedSequence(root_seed).spawn(R)]
+            # Sample randomly from the list of runs
+            choices = np.random.default_rng(root_seed).integers(len(run_list), size=R)
+            # Each task refers to its params by their position ('combo') in run_list
+            if adaptive is not None:
+                # (tasks are added a round at a time, below)
+                manifest_tasks = []
+            elif ensemble_size == 1:
+                manifest_tasks = [{'combo': int(choice), 'sims': [i], 'seeds': [seeds[i]]} for i, choice in enumerate(choices)]
+            else:
+                # group together runs with the same parameters, up to ensemble_size at a time
+                manifest_tasks = []
+                for combo in range(len(run_list)):
+                    sim_numbers = np.flatnonzero(choices == combo).tolist()
+                    for start in range(0, len(sim_numbers), ensemble_size):
+                        batch = sim_numbers[start:start+ensemble_size]
+                        manifest_tasks.append({'combo': combo, 'sims': batch, 'seeds': [seeds[i] for i in batch]})
+            for task_id, task in enumerate(manifest_tasks):
+                task['task'] = task_id
+            manifest = {'detail': detail, 'output_format': output_format, 'root_seed': root_seed, 'ensemble_size': ensemble_size,
+                'adaptive': adaptive, 'combos': run_list, 'tasks': manifest_tasks}
+            files.write_manifest(manifest_file, manifest)
+            # start a new (empty) record of finished runs
+            open(done_file, "w").close()
+            done = set()
+
+        # Only run what hasn't been done yet
+        tasks = [(task['combo'], task['sims'], task['seeds']) for task in manifest['tasks'] if not set(task['sims']) <= done]
+
+        # Runs send their results back here, and only this process saves them
+        outputs = {'data': (data_stem, data_file_headers)}
+        if detail == 'agents':
+            outputs['agents'] = (agents_stem, agent_file_headers)
+        if profile_file is not None:
+            outputs['profile'] = (profile_stem, profile_file_headers)
+        writer = files.ResultWriter(outputs, done_file, output_format)
+        if adaptive is not None:
+            # the outcome of each finished run, by combo, for deciding which combos need more runs
+            outcomes = sweep.savedOutcomes(data_file, manifest, done, adaptive['outcome'])
+
+        from tqdm import tqdm
+        # The global params and param combinations are sent to each worker once; tasks are sent a chunk at a time
+        workers = os.cpu_count() or 1
+        chunksize = sweep.chunkSize(len(tasks), workers)
+        start = time.perf_counter()
+        run_time = 0
+        task_count = 0
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=sweep.initWorker, initargs=(GlobalParams, manifest['combos'], detail)) as executor:
+            while True:
+                for task, (results, task_time) in tqdm(zip(tasks, executor.map(sweep.runTask, tasks, chunksize=chunksize)), total=len(tasks)):
+                    # (runs are recorded as done once their results have been saved)
+                    writer.add(results, task[1])
+                    run_time += task_time
+                    if adaptive is not None:
+                        sweep.addOutcomes(outcomes, task[0], results['data'], adaptive['outcome'])
+                task_count += len(tasks)
+                if adaptive is None:
+                    break
+                # Adaptive sweep: next round, for the combos that need more runs (added to the manifest first, so it can be resumed)
+                new_tasks = sweep.adaptiveRound(manifest, outcomes, adaptive)
+                if len(new_tasks) == 0:
+                    break
+                manifest['tasks'] += new_tasks
+                files.write_manifest(manifest_file, manifest)
+                tasks = [(task['combo'], task['sims'], task['seeds']) for task in new_tasks]
+                chunksize = sweep.chunkSize(len(tasks), workers)
+                print('adaptive sweep, next round: {} runs for {} combos'.format(sum(len(task[1]) for task in tasks), len(set(task[0] for task in tasks))))
+        writer.close()
+        wall_time = time.perf_counter() - start
+        print('{} tasks in {:.1f}s on {} workers (chunks of {}); overhead per task: {:.1f}ms'.format(
+            task_count, wall_time, workers, chunksize, 1000*sweep.taskOverhead(task_count, workers, wall_time, run_time)))
+        if adaptive is not None:
+            print(sweep.adaptiveSummary(outcomes, adaptive))
@@ -3,7 +3,10 @@
 
 from landscape import Landscape
 from population import Population
-import pandas as pd, json, sys
+from frames import FrameEncoder
+from profiler import Profiler
+import files
+import numpy as np, json, sys, base64
 
 class GlobalParams():
     """
@@ -27,6 +30,14 @@ class GlobalParams():
     smoothing = 3
     octaves = 4
 
+    # LANDSCAPE REUSE
+    # landscape_seed: if set, the landscape is generated reproducibly from this seed (None = different every run)
+    landscape_seed = None
+    # landscape_cache: directory for caching seeded landscapes so that runs sharing a landscape don't regenerate it (None = no caching)
+    landscape_cache = None
+    # landscape_cache_size: max size of the cache in bytes; least recently used landscapes are removed beyond this
+    landscape_cache_size = 500*10**6
+
     # STRAGEGIES
     # See population.py for a description of what they do
 
@@ -53,17 +64,54 @@ class GlobalParams():
     # 0 = no effect of who else has visited a patch; higher value means agent will avoid popular patches
     anticonformity = {'alpha': 1, 'beta': 9}
     anticonformity_type = 'homogeneous'
+    # social_radius: agents only consider learning from others within this distance. None = anyone in the landscape
+    social_radius = None
     velocity = 0.2
     velocity_type = 'homogeneous'
     depletion_rate = 0.2
     depletion_rate_type = 'homogeneous'
 
+    # EARLY STOPPING
+    # A run can stop before `timesteps` once little more is likely to happen. The rest of its data is then filled in
+    # as if nothing more changed after it stopped (mass and agents' outcomes as they were then), so the output looks the same.
+    # Stopping early DOES change results slightly (any later change is missed). All off by default
+    # stop_at_mass: stop once this much of the mass has been discovered (e.g. 0.99; None = never)
+    stop_at_mass = None
+    # stop_after_unchanged: stop once the mass hasn't changed for this many timesteps (None = never)
+    stop_after_unchanged = None
+    # stop_when_lost: stop once every agent is completely lost (status 3)
+    stop_when_lost = False
+
+    # IMPLEMENTATION
+    # These affect speed, not results
+    # decide_mode: 'batched' (all agents at once) or 'reference' (original one-agent-at-a-time loop)
+    decide_mode = 'batched'
+    # work_mode: 'sequential' (batched by patch) or 'reference' (original loop);
+    # or 'simultaneous', which DOES change results: agents sharing a patch all see its height before any of them work it
+    work_mode = 'sequential'
+    # height_dtype: precision at which landscape heights are stored. 'float32' halves memory but DOES change results slightly
+    height_dtype = 'float64'
+    # check_mass: check the running total of epistemic mass against the whole landscape every time it's used (slow: for debugging)
+    check_mass = False
+    # kernel_backend: 'numpy', or 'numba' to compile the loops over agents in work and decide (see kernels.py; same results).
+    # Only worth it for large populations: slower than 'numpy' at the default agent_number, faster from roughly 200 agents.
+    # Falls back to 'numpy' if numba isn't installed
+    kernel_backend = 'numpy'
+    # profile: record the time spent in each step (and sub-step) of a run, and what agents decided each timestep (see profiler.py).
+    # Saved as an extra table by run_simulations.py, or reported as a message in browser mode. Off: no cost at all
+    profile = False
+
 class Simulation():
     """
     Class for an individual simulation run, combining global parameters with run-specific parameters
     """
-    def __init__(self,global_params,run_params,sim_type,detail):
-        self.params = global_params
+    def __init__(self,global_params,run_params,sim_type,detail,seed=None):
+        # This run's own copy of the params: run-specific params are set on it, leaving global_params itself unchanged
+        # (so runs done one after another in the same process can't affect each other)
+        self.params = global_params()
+        # seed for this run's random number generator: the same seed (and params) always gives the same run
+        # None = unpredictable
+        self.seed = seed
         self.sim_type = sim_type
         self.changed = []
         # 3 levels of detail in reporting are available
@@ -86,24 +134,46 @@ class Simulation():
     def run(self):
         # One run of the simulation, consisting of multiple timesteps during which agents do stuff
         self.report('message', "Python: sim starting...")
-        self.group_data = {}
-        self.agent_data = []
-        self.landscape = Landscape(self.params)
-        self.population = Population(self.landscape, self.params)
+        self.setUp()
+        self.profiler = Profiler(self) if self.params.profile else None
+        stopping = self.params.stop_at_mass is not None or self.params.stop_after_unchanged is not None or self.params.stop_when_lost
+        self.unchanged_steps = 0
+        self.last_mass = np.nan
 
         for timestep in range(self.params.timesteps):
             # This is the stuff that gets done at each timestep
             self.updateData(timestep)
+            if stopping and self.stopEarly(timestep):
+                self.report('message', "Python: stopped early at timestep {}".format(timestep))
+                break
             self.population.move()
             self.population.decide(self.params.timesteps)
+            if self.profiler is not None:
+                self.profiler.countDecisions(self.population)
             self.population.work()
 
         self.report('message', "Python: sim done...")
+        if self.profiler is not None:
+            self.report('message', "Python: profile:\n" + self.profiler.summary())
+
+    def setUp(self):
+        # Create the landscape and population, and somewhere to store data
+        self.group_data = {}
+        self.agent_data = []
+        self.rng = np.random.default_rng(self.seed)
+        self.landscape = Landscape(self.params, self.rng)
+        self.population = Population(self.landscape, self.params, self.rng)
+        # timestep at which the run stopped early (None = it didn't)
+        self.stopped_at = None
+        if self.sim_type == 'browser':
+            self.frames = FrameEncoder()
 
     def updateData(self, timestep):
         #either 'print' the data so that the node app can see it, or store it for later saving
         if self.sim_type == 'browser':
-            self.report("data", json.dumps({'landscape': self.landscape.reportGrid(), 'population': self.population.trackAgents()}))
+            # a binary frame (see frames.py), as base64 text so that it can be passed on as json
+            frame = self.frames.encode(timestep, self.landscape, self.population)
+            self.report("frame", base64.b64encode(frame).decode('ascii'))
         else:
             if self.reportsteps or timestep==self.params.timesteps-1:
                 # Before each timestep OR just final timestep, store the current state of the simulation
@@ -114,16 +184,61 @@ class Simulation():
                 # Report agents' outcomes from previous timestep
                 self.agent_data = self.population.reportSuccess()
 
+    def stoppingCriteria(self):
+        # Has the run met any of the early stopping criteria? (for an ensemble: an array, one per replicate)
+        # Called once per timestep, to keep count of how long the mass has been unchanged
+        params = self.params
+        met = False
+        if params.stop_at_mass is not None:
+            met = np.logical_or(met, self.landscape.epistemicMassDiscovered() >= params.stop_at_mass)
+        if params.stop_after_unchanged is not None:
+            mass = self.landscape.epistemicMass()
+            self.unchanged_steps = np.where(mass == self.last_mass, self.unchanged_steps + 1, 0)
+            self.last_mass = mass
+            met = np.logical_or(met, self.unchanged_steps >= params.stop_after_unchanged)
+        if params.stop_when_lost:
+            met = np.logical_or(met, self.population.allLost())
+        return(met)
+
+    def stopEarly(self, timestep):
+        # Stop at this timestep if the run has met a stopping criterion (and isn't finishing anyway)
+        if not self.stoppingCriteria() or timestep == self.params.timesteps-1:
+            return False
+        self.stopped_at = timestep
+        self.group_data.update(self.remainingRows(timestep, self.landscape.epistemicMassDiscovered()))
+        if self.reportagents:
+            self.agent_data = self.population.reportSuccess()
+        return True
+
+    def remainingRows(self, timestep, mass):
+        # Group data for the timesteps after stopping at this one, as if mass stayed the same
+        # (only the last timestep, unless reporting every timestep)
+        last = self.params.timesteps-1
+        return {later: {'timestep': later, 'mass': mass} for later in range(timestep+1, last+1) if self.reportsteps or later == last}
+
     def collectData(self, sim_number, details='time'):
         # Include whatever variables have changed in this specific run in the run's data,
         if details in ['time', 'basic']:
-            data_out = pd.DataFrame.from_dict(self.group_data, orient="index").round(2)
+            return self.formatData(self.group_data, sim_number, self.seed)
         elif details =='agents':
-            data_out = pd.DataFrame.from_dict(self.agent_data, orient="index").round(2)
+            return self.formatData(self.agent_data, sim_number, self.seed)
+        elif details == 'profile':
+            # (not rounded: many sub-steps take well under 0.01ms)
+            return self.formatData(self.profiler.rows(), sim_number, self.seed, decimals=None)
         else:
-            raise Exception("details arg not recognised (choose from: 'time', 'agents', 'basic')")
+            raise Exception("details arg not recognised (choose from: 'time', 'agents', 'basic', 'profile')")
 
+    def formatData(self, data, sim_number, seed, decimals=2):
+        # Turn group or agent data (dict of rows) into a dataframe, with the sim number, seed and run-specific params as extra columns
+        # (rounded to decimals places, unless decimals is None)
+        # (pandas is only imported here, as it's slow to import and isn't needed in browser mode)
+        import pandas as pd
+        data_out = pd.DataFrame.from_dict(data, orient="index")
+        if decimals is not None:
+            data_out = data_out.round(decimals)
         data_out['sim'] = sim_number
+        # (as uint64, so that seeds from different runs can be combined without losing precision)
+        data_out['seed'] = seed if seed is None else np.uint64(seed)
         for param_name in self.changed:
             param_value = getattr(self.params, param_name)
 
@@ -148,14 +263,15 @@ class Simulation():
                 print(data)
 
 def singleRun(inputs):
-    glob, loc, i, detail, data_file, agents_file = inputs
-    simulation = Simulation(glob, loc, 'silent', detail)
+    glob, loc, i, seed, detail = inputs
+    simulation = Simulation(glob, loc, 'silent', detail, seed)
     simulation.run()
+    # Send the results back as columns, to be saved by the main process (see files.ResultWriter)
     # We'll always need data on the overall/group outcomes
-    group_data = simulation.collectData(i, detail)
-    group_data.to_csv(data_file, mode="a", header=False, index=False)
+    results = {'data': files.result_columns(simulation.collectData(i))}
     # If necessary, also provide data on individual agents
     if detail == 'agents':
-        agent_data = simulation.collectData(i, 'agents')
-        agent_data.to_csv(agents_file, mode="a", header=False, index=False)
-    return("done")
+        results['agents'] = files.result_columns(simulation.collectData(i, 'agents'))
+    if simulation.params.profile:
+        results['profile'] = files.result_columns(simulation.collectData(i, 'profile'))
+    return(results)
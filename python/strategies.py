@@ -1,6 +1,6 @@
 import numpy as np
 
-def set_thresholds(params):
+def set_thresholds(params, rng):
     # SET SOCIAL LEARNING THRESHOLDS
     # The social learning thresholds can be set as:
         # distributions (beta, gamma)
@@ -35,10 +35,10 @@ def set_thresholds(params):
     elif params.social_threshold_type == 'heterogeneous':
         if 'alpha' in params.social_threshold and 'beta' in params.social_threshold:
             # it's a beta distribution
-            return np.random.beta(params.social_threshold['alpha'], params.social_threshold['beta'], params.agent_number)
+            return rng.beta(params.social_threshold['alpha'], params.social_threshold['beta'], params.agent_number)
         elif 'k' in params.social_threshold and 'theta' in params.social_threshold:
             # it's a gamma distribution
-            return np.random.gamma(params.social_threshold['k'], params.social_threshold['theta'], params.agent_number)
+            return rng.gamma(params.social_threshold['k'], params.social_threshold['theta'], params.agent_number)
         elif 'proportion' in params.social_threshold and 'conformist_threshold' in params.social_threshold and 'maverick_threshold' in params.social_threshold:
             # 'proportion' refers to proportion of mavericks (p) vs. conformists (1-p)
             mavericks_count = int(params.agent_number*params.social_threshold['proportion'])
@@ -62,7 +62,7 @@ def set_velocity(params):
     else:
         raise Exception("Variable velocity not yet implemented!")
 
-def set_anticonformity(params):
+def set_anticonformity(params, rng):
     if params.resilience == 0:
         return 0
     elif params.anticonformity_type == 'homogeneous':
@@ -74,11 +74,11 @@ def set_anticonformity(params):
     else:
         if 'alpha' in params.anticonformity and 'beta' in params.anticonformity:
             # it's a beta distribution
-            return np.random.beta(params.anticonformity['alpha'], params.anticonformity['beta'], params.agent_number)
+            return rng.beta(params.anticonformity['alpha'], params.anticonformity['beta'], params.agent_number)
         else:
             raise Exception("Other forms of anticonformity not yet implemented!")
 
-def set_resilience(params):
+def set_resilience(params, rng):
     if params.resilience == 0:
         return 0
     if params.resilience_type == 'homogeneous':
@@ -90,12 +90,12 @@ def set_resilience(params):
     else:
         if 'alpha' in params.resilience and 'beta' in params.resilience:
             # it's a beta distribution
-            return np.random.beta(params.resilience['alpha'], params.resilience['beta'], params.agent_number)
+            return rng.beta(params.resilience['alpha'], params.resilience['beta'], params.agent_number)
         else:
             raise Exception("Other forms of resilience not yet implemented!")
 
-def set_tolerance(params):
+def set_tolerance(params, rng):
     if params.tolerance_type == 'homogeneous':
         return params.tolerance
     else:
-        return np.random.binomial(1, params.tolerance, params.agent_number)
+        return rng.binomial(1, params.tolerance, params.agent_number)
@@ -0,0 +1,121 @@
+# Functions for running a sweep's tasks in worker processes (see run_simulations.py)
+# Everything that is the same for every task (global params, the list of param combinations, level of detail)
+# is sent to each worker once, by initWorker(); each task is then just (combo id, sim numbers, seeds)
+# Also: choosing the runs for each round of an adaptive sweep (see adaptiveRound())
+
+import time
+import numpy as np
+from simulation import singleRun
+from ensemble import ensembleRun
+import files
+
+# Set in each worker by initWorker()
+config = {}
+
+def initWorker(glob, combos, detail):
+    config['glob'] = glob
+    config['combos'] = combos
+    config['detail'] = detail
+
+def runTask(task):
+    # One task: a single run, or an ensemble of runs with the same params
+    # Returns the results and how long the runs themselves took (see taskOverhead())
+    combo_id, sims, seeds = task
+    start = time.perf_counter()
+    if len(sims) == 1:
+        results = singleRun((config['glob'], config['combos'][combo_id], sims[0], seeds[0], config['detail']))
+    else:
+        results = ensembleRun((config['glob'], config['combos'][combo_id], sims, seeds, config['detail']))
+    return(results, time.perf_counter() - start)
+
+def chunkSize(task_count, workers):
+    # How many tasks to send to a worker at a time: big enough to spread the cost of sending them,
+    # small enough that the workers finish at about the same time (and results are saved regularly)
+    return(max(1, min(32, task_count // (4*workers))))
+
+def taskOverhead(task_count, workers, wall_time, run_time):
+    # Time per task not spent doing runs (sending tasks and results between processes, saving results, idle workers),
+    # in seconds, from the total time of the sweep and the total time of the runs
+    if task_count == 0:
+        return(0)
+    return(max(0, wall_time*workers - run_time)/task_count)
+
+# ADAPTIVE SWEEPS
+# Instead of a fixed number of runs, each combo (cell) gets runs in rounds until the mean of its outcome
+# (e.g. the final mass) is known precisely enough: see run_simulations.py for the settings
+
+def runSeeds(root_seed, first_sim, count):
+    # Seeds of runs first_sim onwards (as for a fixed sweep: the seed of run i is derived from child i of the root seed sequence)
+    children = np.random.SeedSequence(root_seed).spawn(first_sim + count)[first_sim:]
+    return([int(child.generate_state(1, np.uint64)[0]) for child in children])
+
+def finalOutcomes(columns, outcome):
+    # OUTPUT: {sim number: outcome at the last timestep saved} for the runs in a table of results (as columns)
+    sims = np.asarray(columns['sim'])
+    order = np.lexsort((np.asarray(columns['timestep']), sims))
+    last = order[np.append(sims[order][1:] != sims[order][:-1], True)]
+    return(dict(zip(sims[last].tolist(), np.asarray(columns[outcome], dtype=np.float64)[last].tolist())))
+
+def addOutcomes(outcomes, combo, columns, outcome):
+    # outcomes: {combo: {sim number: outcome}}, updated with a finished task's results
+    outcomes.setdefault(combo, {}).update(finalOutcomes(columns, outcome))
+
+def savedOutcomes(data_file, manifest, done, outcome):
+    # Outcomes of the runs already done, from their saved results (when resuming an adaptive sweep)
+    if len(done) == 0:
+        return({})
+    if data_file.endswith('.csv'):
+        import pandas as pd
+        data = pd.read_csv(data_file)
+    else:
+        data = files.load_results(data_file)
+    combo_of = {sim: task['combo'] for task in manifest['tasks'] for sim in task['sims']}
+    outcomes = {}
+    for sim, value in finalOutcomes({name: data[name].to_numpy() for name in ['sim', 'timestep', outcome]}, outcome).items():
+        if sim in done:
+            outcomes.setdefault(combo_of[sim], {})[sim] = value
+    return(outcomes)
+
+def intervalWidth(values, confidence):
+    # Width of the (t-distribution) confidence interval of the mean of values
+    if len(values) < 2:
+        return(np.inf)
+    from scipy.stats import t
+    return(2*t.ppf((1 + confidence)/2, len(values) - 1)*np.std(values, ddof=1)/np.sqrt(len(values)))
+
+def adaptiveRound(manifest, outcomes, adaptive):
+    """
+    Tasks for the next round of an adaptive sweep: min_runs for each combo to start with,
+    then round_size more at a time for each combo whose confidence interval is still wider than ci_width (up to max_runs)
+    OUTPUT: list of new tasks (for the manifest), empty once every combo is done
+    """
+    runs_so_far = {}
+    for task in manifest['tasks']:
+        runs_so_far[task['combo']] = runs_so_far.get(task['combo'], 0) + len(task['sims'])
+    next_sim = sum(runs_so_far.values())
+    next_task = len(manifest['tasks'])
+    new_tasks = []
+    for combo in range(len(manifest['combos'])):
+        runs = runs_so_far.get(combo, 0)
+        if runs < adaptive['min_runs']:
+            count = adaptive['min_runs'] - runs
+        elif runs >= adaptive['max_runs'] or intervalWidth(list(outcomes.get(combo, {}).values()), adaptive['confidence']) <= adaptive['ci_width']:
+            continue
+        else:
+            count = min(adaptive['round_size'], adaptive['max_runs'] - runs)
+        sim_numbers = list(range(next_sim, next_sim + count))
+        seeds = runSeeds(manifest['root_seed'], next_sim, count)
+        next_sim += count
+        # (runs are grouped into ensembles of up to ensemble_size, as for a fixed sweep)
+        for start in range(0, count, manifest['ensemble_size']):
+            new_tasks.append({'combo': combo, 'sims': sim_numbers[start:start+manifest['ensemble_size']],
+                'seeds': seeds[start:start+manifest['ensemble_size']], 'task': next_task})
+            next_task += 1
+    return(new_tasks)
+
+def adaptiveSummary(outcomes, adaptive):
+    runs = [len(values) for values in outcomes.values()]
+    widths = [intervalWidth(list(values.values()), adaptive['confidence']) for values in outcomes.values()]
+    precise = sum(width <= adaptive['ci_width'] for width in widths)
+    return('{} runs over {} combos ({}-{} per combo); {} combos reached a {:.0%} interval narrower than {} for {}'.format(
+        sum(runs), len(runs), min(runs, default=0), max(runs, default=0), precise, adaptive['confidence'], adaptive['ci_width'], adaptive['outcome']))
@@ -0,0 +1,52 @@
+# A long-lived python process that runs browser simulations for the node app (see libs/pool.js),
+# so that each simulation doesn't have to wait for python to start and import numpy etc.
+# Reads one job per line from stdin, as json: {"params": {...}} (the run-specific params, as for run_simulations.py browser)
+# Once started, writes {"type": "ready"}; then for each job, writes the simulation's output to stdout, as for run_simulations.py browser, followed by {"type": "done"}
+# (or {"type": "error", "data": ...} if the simulation failed)
+
+import sys, json, traceback
+from simulation import Simulation, GlobalParams
+
+# Params that requests from the browser may set. Anything else is rejected, e.g. the landscape cache's directory,
+# or implementation settings (decide_mode, work_mode, height_dtype, check_mass, kernel_backend, profile)
+BROWSER_PARAMS = ['map_size', 'timesteps', 'agent_number', 'desert', 'sig_threshold', 'hill_number', 'hill_width',
+    'noise', 'smoothing', 'octaves', 'landscape_seed',
+    'social_threshold', 'social_threshold_type', 'tolerance', 'tolerance_type', 'resilience', 'resilience_type',
+    'anticonformity', 'anticonformity_type', 'social_radius', 'velocity', 'velocity_type', 'depletion_rate', 'depletion_rate_type',
+    'stop_at_mass', 'stop_after_unchanged', 'stop_when_lost']
+# Limits (min, max) on the params that set how much work a run is, so that one request can't tie up a worker
+BROWSER_LIMITS = {'map_size': (10, 128), 'timesteps': (1, 1000), 'agent_number': (1, 200)}
+
+def browserParams(params):
+    """
+    INPUT: run-specific params, as sent by the browser
+    OUTPUT: the same params, with those in BROWSER_LIMITS clamped to their limits
+    """
+    not_allowed = [name for name in params if name not in BROWSER_PARAMS]
+    if len(not_allowed) > 0:
+        raise Exception("params can't be set from the browser: {}".format(', '.join(not_allowed)))
+    params = dict(params)
+    for name, (lowest, highest) in BROWSER_LIMITS.items():
+        if name in params:
+            if not isinstance(params[name], int) or isinstance(params[name], bool):
+                raise Exception("{} should be an integer".format(name))
+            params[name] = min(max(params[name], lowest), highest)
+    return params
+
+def runJob(job):
+    simulation = Simulation(GlobalParams, browserParams(job.get('params', {})), 'browser', 'time', job.get('seed'))
+    simulation.run()
+
+if __name__ == "__main__":
+    # let the node app know that python has started up
+    print(json.dumps({'type': 'ready'}))
+    sys.stdout.flush()
+    for line in sys.stdin:
+        if len(line.strip()) == 0:
+            continue
+        try:
+            runJob(json.loads(line))
+            print(json.dumps({'type': 'done'}))
+        except Exception:
+            print(json.dumps({'type': 'error', 'data': traceback.format_exc()}))
+        sys.stdout.flush()